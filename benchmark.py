@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+"""
+Benchmarks for walkers and decorations on large synthetic trees.
+
+Every measurement is written as one JSON object per line, so that results of
+different commits can be compared with standard tools:
+
+    python benchmark.py --sizes 1000 100000 --output bench_output.txt
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+import urwid
+from walkers import SimpleTreeWalker, IndexedSimpleTreeWalker
+from walkers import CompactSimpleTreeWalker
+from widgets import TreeBox, TreeListWalker, ArrowTreeListWalker
+from widgets import CollapsibleArrowTreeListWalker
+
+SCREEN = (160, 50)
+
+
+# tree generators. Each returns a list of parent indices, where
+# parents[0] == -1 is the root and parents[i] < i for all other nodes.
+def wide_shape(n):
+    """balanced tree of depth 3"""
+    fanout = max(2, int(round(n ** (1. / 3))))
+    return [-1] + [(i - 1) // fanout for i in range(1, n)]
+
+
+def deep_shape(n, depth=25):
+    """root with chains of `depth` nodes each"""
+    return [-1] + [0 if i % depth == 1 else i - 1 for i in range(1, n)]
+
+
+def skewed_shape(n, seed=0):
+    """irregular tree: most nodes attach to one of the recently added ones"""
+    rnd = random.Random(seed)
+    parents = [-1]
+    for i in range(1, n):
+        if rnd.random() < 0.9:
+            parents.append(rnd.randint(max(0, i - 8), i - 1))
+        else:
+            parents.append(rnd.randint(0, i - 1))
+    return parents
+
+SHAPES = {
+    'wide': wide_shape,
+    'deep': deep_shape,
+    'skewed': skewed_shape,
+}
+
+
+def construct_tree(parents):
+    """
+    build a structure as accepted by SimpleTreeWalker from a list of parent
+    indices, following the `construct_example_tree` pattern in example1.
+    """
+    children = [[] for parent in parents]
+    for i in range(len(parents) - 1, 0, -1):
+        children[parents[i]].append(i)
+    nodes = [None] * len(parents)
+    for i in range(len(parents) - 1, -1, -1):
+        subtrees = [nodes[c] for c in reversed(children[i])] or None
+        nodes[i] = (urwid.Text('Node %d' % i), subtrees)
+    return [nodes[0]]
+
+WALKERS = {
+    'simple': SimpleTreeWalker,
+    'indexed': IndexedSimpleTreeWalker,
+    'compact': CompactSimpleTreeWalker,
+}
+
+DECORATIONS = {
+    'plain': TreeListWalker,
+    'arrow': ArrowTreeListWalker,
+    'collapsible-arrow': CollapsibleArrowTreeListWalker,
+}
+
+
+# benchmarks. Each gets a fresh TreeListWalker and returns the number of
+# operations it performed.
+def bench_scan(listwalker, positions):
+    return len(list(listwalker.positions()))
+
+
+def bench_reverse_scan(listwalker, positions):
+    return len(list(listwalker.positions(reverse=True)))
+
+
+def bench_construct_lines(listwalker, positions):
+    count = min(len(positions), 10000)
+    for pos in positions[:count]:
+        listwalker[pos]
+    return count
+
+
+def bench_render(listwalker, positions):
+    treebox = TreeBox(listwalker)
+    pages = 10
+    treebox.render(SCREEN, focus=True)
+    for i in range(pages):
+        treebox.keypress(SCREEN, 'page down')
+        treebox.render(SCREEN, focus=True)
+    return pages + 1
+
+
+def bench_focus_jumps(listwalker, positions):
+    rnd = random.Random(0)
+    treebox = TreeBox(listwalker)
+    jumps = 20
+    for i in range(jumps):
+        listwalker.set_focus(rnd.choice(positions))
+        treebox.render(SCREEN, focus=True)
+    return jumps
+
+
+def bench_collapse_expand_all(listwalker, positions):
+    if not hasattr(listwalker, 'collapse_all'):
+        return None
+    treebox = TreeBox(listwalker)
+    listwalker.collapse_all()
+    treebox.render(SCREEN, focus=True)
+    listwalker.expand_all()
+    treebox.render(SCREEN, focus=True)
+    return 2
+
+BENCHMARKS = [
+    ('scan', bench_scan),
+    ('reverse-scan', bench_reverse_scan),
+    ('construct-lines', bench_construct_lines),
+    ('render', bench_render),
+    ('focus-jumps', bench_focus_jumps),
+    ('collapse-expand-all', bench_collapse_expand_all),
+]
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      stderr=subprocess.STDOUT)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, shapes, walkers, decorations, benchmarks, out):
+    revision = git_revision()
+    for shape in shapes:
+        for size in sizes:
+            start = timer()
+            treelist = construct_tree(SHAPES[shape](size))
+            build_time = timer() - start
+            for walkername in walkers:
+                start = timer()
+                walker = WALKERS[walkername](treelist)
+                init_time = timer() - start
+                positions = list(TreeListWalker(walker).positions())
+                for deconame in decorations:
+                    for benchname, bench in BENCHMARKS:
+                        if benchname not in benchmarks:
+                            continue
+                        listwalker = DECORATIONS[deconame](walker)
+                        start = timer()
+                        ops = bench(listwalker, positions)
+                        seconds = timer() - start
+                        if ops is None:
+                            continue
+                        record = {
+                            'revision': revision,
+                            'benchmark': benchname,
+                            'shape': shape,
+                            'nodes': size,
+                            'walker': walkername,
+                            'decoration': deconame,
+                            'seconds': seconds,
+                            'operations': ops,
+                            'tree_build_seconds': build_time,
+                            'walker_init_seconds': init_time,
+                        }
+                        out.write(json.dumps(record, sort_keys=True) + '\n')
+                        out.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES),
+                        default=sorted(SHAPES))
+    parser.add_argument('--walkers', nargs='+', choices=sorted(WALKERS),
+                        default=sorted(WALKERS))
+    parser.add_argument('--decorations', nargs='+',
+                        choices=sorted(DECORATIONS),
+                        default=sorted(DECORATIONS))
+    parser.add_argument('--benchmarks', nargs='+',
+                        choices=[name for name, _ in BENCHMARKS],
+                        default=[name for name, _ in BENCHMARKS])
+    parser.add_argument('--output', help='file to append results to')
+    args = parser.parse_args()
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        run(args.sizes, args.shapes, args.walkers, args.decorations,
+            args.benchmarks, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,174 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+
+from collections import OrderedDict
+
+
+class Cache(object):
+    """
+    Unbounded cache as used by :class:`walkers.CachingTreeWalker` and
+    :class:`widgets.CachingMixin`. It behaves like a dict but counts hits,
+    misses and evictions so that cache policies can be tuned.
+
+    Both caching classes accept a `cache_policy`, which is a callable
+    returning a fresh cache object, e.g. this class or
+    `functools.partial(LRUCache, max_entries=5000)`.
+    """
+    def __init__(self, on_evict=None):
+        """
+        :param on_evict: called with key and value of every entry
+            that is dropped to keep the cache within its bounds.
+        :type on_evict: callable
+        """
+        self._data = self._new_storage()
+        self._on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _new_storage(self):
+        return {}
+
+    def get(self, key, default=None):
+        """return value for key, or `default`; counts as hit or miss"""
+        if key in self._data:
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def pop(self, key, default=None):
+        if key in self._data:
+            value = self._data[key]
+            del self[key]
+            return value
+        return default
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        """returns a dict of counters describing the cache usage"""
+        return {'entries': len(self), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def _evict(self, key):
+        """drop entry for key and notify the eviction callback"""
+        value = self._data[key]
+        del self[key]
+        self.evictions += 1
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+
+class LRUCache(Cache):
+    """
+    Cache that drops least recently used entries once it holds more than
+    `max_entries` entries or once the estimated size of its entries exceeds
+    `max_size`. Sizes are estimated by `sizeof`, which defaults to counting
+    every entry as 1; use :func:`widget_count` to weigh line widgets by
+    the number of widgets they are made of.
+    """
+    def __init__(self, max_entries=None, max_size=None, sizeof=None,
+                 on_evict=None):
+        """
+        :param max_entries: maximal number of entries
+        :type max_entries: int
+        :param max_size: maximal sum of entry sizes as estimated by `sizeof`
+        :type max_size: int
+        :param sizeof: callable that estimates the size of a cached value
+        :param on_evict: called with key and value of every dropped entry
+        """
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._sizeof = sizeof
+        self._sizes = {}
+        self.size = 0
+        Cache.__init__(self, on_evict=on_evict)
+
+    def _new_storage(self):
+        return OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self.hits += 1
+            # move entry to the most recently used end
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            del self[key]
+        self._data[key] = value
+        if self._sizeof is not None:
+            size = self._sizeof(value)
+            self._sizes[key] = size
+            self.size += size
+        else:
+            self.size += 1
+        self._shrink()
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.size -= self._sizes.pop(key, 1)
+
+    def clear(self):
+        Cache.clear(self)
+        self._sizes.clear()
+        self.size = 0
+
+    def stats(self):
+        stats = Cache.stats(self)
+        stats['size'] = self.size
+        return stats
+
+    def _shrink(self):
+        """evict oldest entries until we are within bounds again"""
+        while len(self._data) > 1 and (
+                (self._max_entries is not None and
+                 len(self._data) > self._max_entries) or
+                (self._max_size is not None and self.size > self._max_size)):
+            self._evict(next(iter(self._data)))
+
+
+def widget_count(widget):
+    """
+    estimate the size of a (line) widget by counting the widgets it consists
+    of. This descends into containers and decorations and counts shared
+    widgets only once.
+    """
+    seen = set()
+    stack = [widget]
+    while stack:
+        w = stack.pop()
+        if w is None or id(w) in seen:
+            continue
+        seen.add(id(w))
+        contents = getattr(w, 'contents', None)
+        if isinstance(contents, list):
+            for entry in contents:
+                stack.append(entry[0] if isinstance(entry, tuple) else entry)
+        stack.append(getattr(w, 'original_widget', None))
+        stack.append(getattr(w, '_w', None))
+    return len(seen)
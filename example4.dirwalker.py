@@ -6,7 +6,7 @@ import urwid
 import os
 from example1 import palette  # example data
 from widgets import TreeBox
-from walkers import CachingTreeWalker
+from walkers import FilesystemTreeWalker
 from widgets import CollapsibleArrowTreeListWalker
 
 
@@ -24,83 +24,18 @@ class FocusableText(urwid.WidgetWrap):
         return key
 
 
-class DirectoryWalker(CachingTreeWalker):
+class DirectoryWalker(FilesystemTreeWalker):
     """
-    A custom TreeWalker representing our filesystem structure.
-    We subclass CachingTreeWalker instead of TreeWalker to cache constructed lines..
+    A TreeWalker representing our filesystem structure.
+    FilesystemTreeWalker caches directory listings, we only need to tell it
+    how to construct widgets for paths.
     """
-    # determine dir separator and form of root node
-    pathsep = os.path.sep
-    drive, _ = os.path.splitdrive(pathsep)
-
-    # define root node This is part of the TreeWalker API!
-    root = drive + pathsep
-
-    # initialize and tell Caching superclass how to construct new lines
     def __init__(self):
-        CachingTreeWalker.__init__(self, self.load_widget)
+        FilesystemTreeWalker.__init__(self, self.load_widget)
 
     def load_widget(self, pos):
         return FocusableText(pos)
 
-    # generic helper
-    def _list_dir(self, path):
-        """returns absolute paths for all entries in a directory"""
-        try:
-            elements = [os.path.join(
-                path, x) for x in os.listdir(path) if os.path.isdir(path)]
-            elements.sort()
-        except OSError:
-            elements = None
-        return elements
-
-    def _get_siblings(self, pos):
-        """lists the parent directory of pos """
-        parent = self.parent_position(pos)
-        siblings = [pos]
-        if parent is not None:
-            siblings = self._list_dir(parent)
-        return siblings
-
-    # TreeWalker API
-    def parent_position(self, pos):
-        parent = None
-        if pos != '/':
-            parent = os.path.split(pos)[0]
-        return parent
-
-    def first_child_position(self, pos):
-        candidate = None
-        if os.path.isdir(pos):
-            children = self._list_dir(pos)
-            if children:
-                candidate = children[0]
-        return candidate
-
-    def last_child_position(self, pos):
-        candidate = None
-        if os.path.isdir(pos):
-            children = self._list_dir(pos)
-            if children:
-                candidate = children[-1]
-        return candidate
-
-    def next_sibling_position(self, pos):
-        candidate = None
-        siblings = self._get_siblings(pos)
-        myindex = siblings.index(pos)
-        if myindex + 1 < len(siblings):  # pos is not the last entry
-            candidate = siblings[myindex + 1]
-        return candidate
-
-    def prev_sibling_position(self, pos):
-        candidate = None
-        siblings = self._get_siblings(pos)
-        myindex = siblings.index(pos)
-        if myindex > 0:  # pos is not the first entry
-            candidate = siblings[myindex - 1]
-        return candidate
-
 if __name__ == "__main__":
     cwd = os.getcwd()  # get current working directory
     walker = DirectoryWalker()  # get a directory walker
@@ -124,4 +59,6 @@ if __name__ == "__main__":
 
     # stick it into a TreeBox and use 'body' color attribute for gaps
     treebox = urwid.AttrMap(TreeBox(dwalker), 'body')
-    urwid.MainLoop(treebox, palette).run()  # go
+    loop = urwid.MainLoop(treebox, palette)
+    walker.watch(loop)  # pick up changes to displayed directories
+    loop.run()  # go
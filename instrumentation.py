@@ -0,0 +1,449 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+
+import heapq
+import json
+from bisect import bisect_left
+from collections import deque
+from timeit import default_timer
+
+
+# methods counted by default, if the instrumented object has them
+POSITION_METHODS = (
+    '__getitem__',
+    'parent_position',
+    'first_child_position',
+    'last_child_position',
+    'next_sibling_position',
+    'prev_sibling_position',
+    'next_position',
+    'prev_position',
+    '_construct_line',
+)
+
+# caches of :class:`widgets.CachingMixin`, named like in its `cache_stats`
+CACHE_ATTRIBUTES = (
+    ('_cache', 'lines'),
+    ('_next_cache', 'next'),
+    ('_prev_cache', 'prev'),
+)
+
+
+# marks attributes that were not set on the instance before instrumenting
+_UNSET = object()
+
+
+def _is_removed(obj):
+    """
+    determine if obj, a wrapper function or generated class, belongs to an
+    instrumentation that has been removed since
+    """
+    owner = getattr(obj, '__dict__', {}).get('_instrumented_by')
+    return owner is not None and owner[0]._generation != owner[1]
+
+
+def _unwrap_method(method):
+    """
+    the bound method method, without the wrappers of removed
+    instrumentations
+    """
+    function = getattr(method, '__func__', None)
+    if function is None or not _is_removed(function):
+        return method
+    while _is_removed(function):
+        function = function.wrapped
+    return function.__get__(method.__self__)
+
+
+class Instrumentation(object):
+    """
+    Opt-in counters for the hot paths of tree display. Instrumenting an object
+    switches its class to a generated subclass whose methods count and time
+    their calls; objects that are not instrumented are not affected at all.
+
+    Times are cumulative, i.e. they include the time spent in nested
+    instrumented calls: `next_position` of a decoration includes the calls
+    to the position methods of the TreeWalker it wraps.
+
+    Typical use::
+
+        instr = Instrumentation()
+        instr.instrument_treebox(treebox)
+        ...  # interact with the tree
+        print(instr.stats())
+        instr.remove()
+    """
+    def __init__(self, clock=default_timer):
+        """
+        :param clock: callable returning the current time in seconds
+        """
+        self.enabled = True
+        self.frames = 0
+        self._clock = clock
+        self._counters = {}  # label -> [calls, seconds]
+        # (object, attribute, original value or _UNSET, installed value)
+        self._originals = []
+        self._attached = False  # whether wrapped renders count frames
+        # incremented by remove, which turns all wrappers and generated
+        # classes of earlier generations into pass-throughs
+        self._generation = 0
+
+    def _wrap(self, label, method):
+        """returns a function that calls method and counts that call"""
+        counter = self._counters.setdefault(label, [0, 0.0])
+        clock = self._clock
+        instrumentation = self
+        generation = self._generation
+
+        def counting(obj, *args, **kwargs):
+            if not instrumentation.enabled or \
+                    instrumentation._generation != generation:
+                return method(obj, *args, **kwargs)
+            start = clock()
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start
+        counting.__name__ = method.__name__
+        counting.__doc__ = method.__doc__
+        counting.wrapped = method
+        counting._instrumented_by = (self, generation)
+        return counting
+
+    def instrument(self, obj, label, methods=POSITION_METHODS):
+        """
+        count calls to given methods of obj. Statistics are collected
+        under `<label>.<method name>`.
+
+        :param obj: object to instrument, e.g. a TreeWalker or TreeListWalker
+        :param label: prefix for the names of the counters
+        :type label: str
+        :param methods: names of the methods to count. Names obj doesn't
+            have are ignored.
+        """
+        if any(o is obj and a == '__class__'
+               for o, a, _, _ in self._originals):
+            return
+        cls = obj.__class__
+        namespace = {'__slots__': (),
+                     '_instrumented_by': (self, self._generation)}
+        for name in methods:
+            method = getattr(cls, name, None)
+            if method is not None:
+                namespace[name] = self._wrap('%s.%s' % (label, name), method)
+        instrumented = type(cls)('Instrumented' + cls.__name__, (cls,),
+                                 namespace)
+        obj.__class__ = instrumented
+        self._originals.append((obj, '__class__', cls, instrumented))
+
+        # rebind methods obj keeps references to, like `CachingMixin.load`
+        for attribute, value in list(getattr(obj, '__dict__', {}).items()):
+            if getattr(value, '__self__', None) is obj and \
+                    value.__name__ in namespace:
+                setattr(obj, attribute, getattr(obj, value.__name__))
+                self._originals.append(
+                    (obj, attribute, value, getattr(obj, attribute)))
+
+        # count lookups in the caches of CachingMixin
+        for attribute, name in CACHE_ATTRIBUTES:
+            cache = getattr(obj, attribute, None)
+            if cache is not None:
+                self.instrument(cache, '%s.%s' % (label, name), ('get',))
+
+    def instrument_treebox(self, treebox):
+        """
+        instrument a TreeBox: its frames, the TreeListWalker it displays
+        (label 'decoration') and the TreeWalker that one wraps
+        (label 'walker').
+        """
+        render = treebox.render
+
+        def counting_render(obj, *args, **kwargs):
+            if self.enabled and self._attached:
+                self.frames += 1
+            return render(*args, **kwargs)
+        counting_render.__name__ = 'render'
+        self._replace_render(treebox, self._wrap('treebox.render',
+                                                 counting_render))
+
+        self.instrument(treebox._walker, 'decoration')
+        self.instrument(treebox._walker._walker, 'walker')
+
+    def _replace_render(self, treebox, render):
+        """
+        install function render as method of treebox. It wraps whatever
+        `treebox.render` was, which may be the wrapper of another
+        instrumentation, and passes calls through once this one is removed.
+        """
+        original = treebox.__dict__.get('render', _UNSET)
+        render.original = original
+        render.removed = False
+        treebox.render = render.__get__(treebox)
+        self._originals.append((treebox, 'render', original,
+                                treebox.render))
+        self._attached = True
+
+    def count_frame(self):
+        """
+        count a rendered frame, for trees that are not displayed in an
+        instrumented TreeBox
+        """
+        if self.enabled:
+            self.frames += 1
+
+    def stats(self):
+        """
+        returns a dict that maps counter names to dicts with the number of
+        calls, cumulative seconds and calls per frame (None if no frame has
+        been counted).
+        """
+        result = {}
+        for label, (calls, seconds) in self._counters.items():
+            per_frame = None
+            if self.frames:
+                per_frame = float(calls) / self.frames
+            result[label] = {'calls': calls, 'seconds': seconds,
+                             'calls_per_frame': per_frame}
+        return result
+
+    def reset(self):
+        """set all counters to zero"""
+        self.frames = 0
+        for counter in self._counters.values():
+            counter[0] = 0
+            counter[1] = 0.0
+
+    def remove(self):
+        """
+        undo all instrumentation done by this object. Where another
+        instrumentation has been applied on top of it since, its wrappers
+        are left in place but only pass calls on, and they are skipped when
+        that instrumentation is removed.
+        """
+        self._generation += 1
+        for obj, attribute, original, installed in reversed(self._originals):
+            if attribute == '__class__':
+                if type(obj) is not installed:
+                    continue
+                while _is_removed(original):
+                    original = original.__bases__[0]
+                obj.__class__ = original
+                continue
+            if attribute == 'render':
+                installed.__func__.removed = True
+            if obj.__dict__.get(attribute) is not installed:
+                # wrapped by a later instrumentation; ours passes through
+                # and is skipped when that one is removed
+                continue
+            if attribute == 'render':
+                while getattr(getattr(original, '__func__', None),
+                              'removed', False):
+                    original = original.__func__.original
+            else:
+                original = _unwrap_method(original)
+            if original is _UNSET:
+                obj.__dict__.pop(attribute, None)
+            else:
+                setattr(obj, attribute, original)
+        self._originals = []
+        self._attached = False
+
+
+# upper bounds of the buckets of :meth:`FrameProfiler.histogram` in seconds
+FRAME_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.0167, 0.0333, 0.05, 0.1, 0.25,
+                 float('inf'))
+
+
+class FrameProfiler(Instrumentation):
+    """
+    Records where the time of every frame of a TreeBox goes. For each call
+    to `render` it keeps
+
+     * `seconds`: the duration of the frame,
+     * `walker`: time spent in the TreeWalker, e.g. to load widgets,
+     * `navigation`: time spent in position methods of the decoration,
+     * `decoration`: time spent constructing and looking up decorated lines,
+     * `canvas`: the remaining time, mostly composing canvases in urwid,
+     * `lines_built` and `lines_cached`: the number of lines constructed and
+       served from the decoration's cache,
+     * `slowest`: the positions whose lines took longest to construct,
+       as list of `(seconds, position)` pairs.
+
+    Times are exclusive, e.g. loading a widget while constructing a line only
+    counts as `walker`. Lines that ListBox builds while handling keys, like
+    `page down`, belong to no frame. The most recent `window` frames are kept for
+    queries; frames that take longer than `budget` are reported to
+    `on_over_budget` right away::
+
+        profiler = FrameProfiler(budget=0.02)
+        treebox = TreeBox(walker, profiler=profiler)
+        ...
+        print(profiler.percentile(0.99), profiler.histogram())
+    """
+    def __init__(self, budget=0.0167, window=1000, slowest=5,
+                 on_over_budget=None, clock=default_timer):
+        """
+        :param budget: maximal duration of a frame in seconds
+        :type budget: float
+        :param window: number of recent frames to keep
+        :type window: int
+        :param slowest: number of slowest positions to keep per frame
+        :type slowest: int
+        :param on_over_budget: called with the record of every frame that
+            exceeds the budget
+        :param clock: callable returning the current time in seconds
+        """
+        Instrumentation.__init__(self, clock)
+        self.budget = budget
+        self._slowest = slowest
+        self._on_over_budget = on_over_budget
+        self._frames = deque(maxlen=window)
+        self._frame = None  # record of the frame being rendered
+        self._stack = []  # [category, time the category was (re)entered]
+
+    def _category(self, label):
+        if label.startswith('walker.'):
+            return 'walker'
+        if label.startswith('decoration.') and \
+                label not in ('decoration.__getitem__',
+                              'decoration._construct_line') and \
+                label.count('.') == 1:
+            return 'navigation'
+        return 'decoration'
+
+    def _wrap(self, label, method):
+        """returns a function that calls method and times it exclusively"""
+        counter = self._counters.setdefault(label, [0, 0.0])
+        category = self._category(label)
+        clock = self._clock
+        profiler = self
+        stack = self._stack
+        is_construct = label == 'decoration._construct_line'
+        is_request = label == 'decoration.__getitem__'
+
+        generation = self._generation
+
+        def profiled(obj, *args, **kwargs):
+            frame = profiler._frame
+            if not profiler.enabled or frame is None or \
+                    profiler._generation != generation:
+                return method(obj, *args, **kwargs)
+            start = clock()
+            if stack:
+                outer = stack[-1]
+                frame[outer[0]] += start - outer[1]
+            entry = [category, start]
+            stack.append(entry)
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                end = clock()
+                stack.pop()
+                frame[category] += end - entry[1]
+                if stack:
+                    stack[-1][1] = end
+                counter[0] += 1
+                counter[1] += end - start
+                if is_construct:
+                    frame['lines_built'] += 1
+                    frame['_constructs'].append((end - start, args[0]))
+                elif is_request:
+                    frame['lines_requested'] += 1
+        profiled.__name__ = method.__name__
+        profiled.__doc__ = method.__doc__
+        profiled.wrapped = method
+        profiled._instrumented_by = (self, generation)
+        return profiled
+
+    def instrument_treebox(self, treebox):
+        """record every frame rendered by treebox"""
+        render = treebox.render
+
+        def profiled_render(obj, *args, **kwargs):
+            if not (self.enabled and self._attached) or \
+                    self._frame is not None:
+                return render(*args, **kwargs)
+            self._begin_frame()
+            try:
+                return render(*args, **kwargs)
+            finally:
+                self._end_frame()
+        profiled_render.__name__ = 'render'
+        self._replace_render(treebox, profiled_render)
+
+        self.instrument(treebox._walker, 'decoration')
+        self.instrument(treebox._walker._walker, 'walker')
+
+    def _begin_frame(self):
+        self._frame = {'walker': 0.0, 'navigation': 0.0, 'decoration': 0.0,
+                       'lines_built': 0, 'lines_requested': 0,
+                       '_constructs': [], 'start': self._clock()}
+
+    def _end_frame(self):
+        frame = self._frame
+        self._frame = None
+        del self._stack[:]
+        seconds = self._clock() - frame.pop('start')
+        constructs = frame.pop('_constructs')
+        frame['seconds'] = seconds
+        frame['canvas'] = max(0.0, seconds - frame['walker'] -
+                              frame['navigation'] - frame['decoration'])
+        frame['lines_cached'] = max(0, frame.pop('lines_requested') -
+                                    frame['lines_built'])
+        frame['slowest'] = heapq.nlargest(self._slowest, constructs,
+                                          key=lambda item: item[0])
+        frame['over_budget'] = seconds > self.budget
+        self.frames += 1
+        self._frames.append(frame)
+        if frame['over_budget'] and self._on_over_budget is not None:
+            self._on_over_budget(frame)
+
+    # queries
+    def recent_frames(self):
+        """records of the frames in the window, oldest first"""
+        return list(self._frames)
+
+    def histogram(self, buckets=FRAME_BUCKETS):
+        """
+        returns a list of `(upper bound, number of frames)` pairs for the
+        durations of the frames in the window
+
+        :param buckets: ascending upper bounds in seconds
+        """
+        counts = [0] * len(buckets)
+        for frame in self._frames:
+            index = bisect_left(buckets, frame['seconds'])
+            if index < len(counts):
+                counts[index] += 1
+        return list(zip(buckets, counts))
+
+    def percentile(self, fraction):
+        """
+        the frame duration that the given fraction (between 0 and 1) of
+        frames in the window doesn't exceed, or None without frames
+        """
+        durations = sorted(frame['seconds'] for frame in self._frames)
+        if not durations:
+            return None
+        index = min(len(durations) - 1, int(fraction * len(durations)))
+        return durations[index]
+
+    def over_budget(self):
+        """records of the frames in the window that exceeded the budget"""
+        return [frame for frame in self._frames if frame['over_budget']]
+
+    def dump(self, out):
+        """
+        write the frames in the window to a file object, one JSON object per
+        line like :mod:`benchmark` does. Positions are written as strings.
+        """
+        for frame in self._frames:
+            record = dict(frame)
+            record['slowest'] = [(seconds, repr(pos))
+                                 for seconds, pos in frame['slowest']]
+            out.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def reset(self):
+        Instrumentation.reset(self)
+        self._frames.clear()
@@ -0,0 +1,242 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from timeit import default_timer
+
+
+def _compute_all(compute, positions):
+    """job run in a worker process: compute the payloads for positions"""
+    return [compute(pos) for pos in positions]
+
+
+class SubtreePrefetcher(object):
+    """
+    Loads the widgets of a :class:`walkers.CachingTreeWalker` for a whole
+    tree in parallel, e.g. before expanding all nodes of a tree whose widgets
+    are expensive to compute.
+
+    The tree is partitioned at a given depth: every subtree below that depth
+    is a job for a process pool, and small subtrees are combined into jobs
+    of at least `min_job_size` positions. Workers compute a picklable payload
+    for every position, from which the widgets are constructed in this
+    process and stored in the walker's cache. Navigating the tree happens in
+    this process as well, so only `compute` needs to be cheap to pickle::
+
+        def render_markup(pos):  # module level, so workers can import it
+            return expensive_markup(pos)
+
+        prefetcher = SubtreePrefetcher(walker, render_markup, urwid.Text)
+        prefetcher.run()
+        listwalker.expand_all()
+    """
+    def __init__(self, walker, compute, build_widget=None, depth=1,
+                 executor=None, max_workers=None, min_job_size=1000):
+        """
+        :param walker: tree whose widgets to load
+        :type walker: walkers.CachingTreeWalker
+        :param compute: picklable callable that returns the payload for a
+            position. It is called in worker processes.
+        :param build_widget: callable that turns a payload into a widget.
+            Defaults to using payloads, which then need to be picklable
+            widgets, directly.
+        :param depth: depth of the roots of the subtrees computed as a whole
+        :type depth: int
+        :param executor: executor to submit jobs to. Defaults to a process
+            pool with `max_workers` processes for the duration of :meth:`run`.
+        :type executor: concurrent.futures.Executor
+        :param min_job_size: minimal number of positions per job
+        :type min_job_size: int
+        """
+        self._walker = walker
+        self._compute = compute
+        self._build_widget = build_widget
+        self._depth = depth
+        self._executor = executor
+        self._max_workers = max_workers
+        self._min_job_size = min_job_size
+
+    def _subtree(self, pos):
+        """positions of pos and its descendants that are not loaded yet"""
+        walker = self._walker
+        positions = []
+        stack = [pos]
+        while stack:
+            current = stack.pop()
+            if not walker.is_loaded(current):
+                positions.append(current)
+            child = walker.last_child_position(current)
+            while child is not None:
+                stack.append(child)
+                child = walker.prev_sibling_position(child)
+        return positions
+
+    def partition(self, root=None):
+        """
+        returns a list of jobs, i.e. lists of positions that are not loaded
+        yet, for the subtree at root, or the whole tree
+
+        :param root: position of a node; defaults to all top-level nodes
+        """
+        walker = self._walker
+        jobs = []
+        job = []
+        stack = []
+        if root is not None:
+            stack.append((root, walker.depth(root)))
+        else:
+            pos = walker.last_sibling_position(walker.root) \
+                if walker.root is not None else None
+            while pos is not None:
+                stack.append((pos, 0))
+                pos = walker.prev_sibling_position(pos)
+        while stack:
+            pos, depth = stack.pop()
+            if depth >= self._depth:
+                job.extend(self._subtree(pos))
+            else:
+                if not walker.is_loaded(pos):
+                    job.append(pos)
+                child = walker.last_child_position(pos)
+                while child is not None:
+                    stack.append((child, depth + 1))
+                    child = walker.prev_sibling_position(child)
+            if len(job) >= self._min_job_size:
+                jobs.append(job)
+                job = []
+        if job:
+            jobs.append(job)
+        return jobs
+
+    def run(self, root=None):
+        """
+        load the widgets for the subtree at root, or the whole tree, and
+        return the number of loaded widgets
+        """
+        jobs = self.partition(root)
+        if not jobs:
+            return 0
+        executor = self._executor
+        if executor is None:
+            executor = ProcessPoolExecutor(self._max_workers)
+        count = 0
+        try:
+            results = executor.map(partial(_compute_all, self._compute), jobs)
+            for positions, payloads in zip(jobs, results):
+                for pos, payload in zip(positions, payloads):
+                    if self._build_widget is not None:
+                        payload = self._build_widget(payload)
+                    self._walker.preload(pos, payload)
+                count += len(positions)
+        finally:
+            if executor is not self._executor:
+                executor.shutdown()
+        return count
+
+
+class LinePrefetcher(object):
+    """
+    Constructs the lines of a :class:`widgets.TreeBox` before they are
+    displayed, while the main loop is idle. Lines are built for the first
+    child of the focussed node, in anticipation of moving the focus there,
+    and for the positions up to `screens` screens ahead of the focus in the
+    direction the focus moved last, or in both directions after a jump.
+
+    Work is done in alarm callbacks after the screen has been drawn, which
+    return after `time_budget` seconds and continue in the next iteration of
+    the loop if no input is pending, so prefetching never delays the reaction
+    to input by more than that. This requires a caching decoration like
+    :class:`widgets.ArrowTreeListWalker`. If the TreeBox releases invisible
+    lines, its `visible_margin` should cover the prefetched screens.
+    """
+    def __init__(self, treebox, loop, screens=2, time_budget=0.005,
+                 rows=None):
+        """
+        :param treebox: tree display to prefetch lines for
+        :type treebox: widgets.TreeBox
+        :param loop: main loop the tree is displayed in
+        :type loop: urwid.MainLoop
+        :param screens: number of screens to prefetch
+        :type screens: int
+        :param time_budget: maximal number of seconds per alarm callback
+        :type time_budget: float
+        :param rows: height of a screen. Defaults to the height of the
+            loop's screen.
+        :type rows: int
+        """
+        self._walker = treebox._walker
+        self._loop = loop
+        self._screens = screens
+        self._time_budget = time_budget
+        self._rows = rows
+        self._focus = None
+        self._work = None
+        self._scheduled = False
+        self._idle_handle = loop.event_loop.enter_idle(self._on_idle)
+
+    def stop(self):
+        """stop prefetching"""
+        self._loop.event_loop.remove_enter_idle(self._idle_handle)
+        self._work = None
+
+    def _screen_rows(self):
+        if self._rows is not None:
+            return self._rows
+        return self._loop.screen.get_cols_rows()[1]
+
+    def _directions(self, old, new):
+        """
+        the methods to walk from new in, guessed from the focus moving from
+        old to new
+        """
+        walker = self._walker
+        both = [walker.next_position, walker.prev_position]
+        if old is None:
+            return both
+        rows = self._screen_rows()
+        if old in walker.walk(new, rows, walker.prev_position):
+            return [walker.next_position]
+        if old in walker.walk(new, rows):
+            return [walker.prev_position]
+        return both
+
+    def _prefetch(self, focus, directions):
+        """generator that builds one line per iteration"""
+        walker = self._walker
+        child = walker.first_child_position(focus)
+        if child is not None:
+            walker[child]
+            yield
+        count = self._screen_rows() * (self._screens + 1)
+        for direction in directions:
+            pos = focus
+            for i in range(count):
+                pos = direction(pos)
+                if pos is None:
+                    break
+                walker[pos]
+                yield
+
+    def _on_idle(self):
+        w, focus = self._walker.get_focus()
+        if focus is not None and focus != self._focus:
+            self._work = self._prefetch(focus,
+                                        self._directions(self._focus, focus))
+            self._focus = focus
+        if self._work is not None and not self._scheduled:
+            # run after the screen has been drawn in this idle phase
+            self._scheduled = True
+            self._loop.set_alarm_in(0, self._step)
+
+    def _step(self, loop=None, user_data=None):
+        self._scheduled = False
+        if self._work is None:
+            return
+        deadline = default_timer() + self._time_budget
+        for _ in self._work:
+            if default_timer() >= deadline:
+                self._scheduled = True
+                self._loop.set_alarm_in(0, self._step)
+                return
+        self._work = None
@@ -0,0 +1,107 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+
+from array import array
+
+
+class RowIndex(object):
+    """
+    Order statistics over the rows of a tree display with collapsible
+    subtrees, as used by :class:`widgets.RowIndexMixin`.
+
+    Nodes are identified by their number in depth-first order, so that the
+    descendants of every node form a contiguous range of numbers. Collapsing
+    a node covers the range of its descendants. A segment tree keeps a cover
+    count and the number of uncovered (i.e. displayed) nodes for ranges of
+    node numbers, so that all operations take logarithmic time.
+    """
+    def __init__(self, n):
+        """
+        :param n: number of nodes in the tree
+        :type n: int
+        """
+        size = 1
+        while size < n:
+            size *= 2
+        self._n = n
+        self._size = size
+        self._cover = array('l', [0]) * (2 * size)
+        # number of nodes in range of each segment tree node
+        self._length = array('l', [0]) * (2 * size)
+        for leaf in range(size, size + n):
+            self._length[leaf] = 1
+        for k in range(size - 1, 0, -1):
+            self._length[k] = self._length[2 * k] + self._length[2 * k + 1]
+        self._free = array('l', self._length)
+
+    def __len__(self):
+        return self._n
+
+    def _pull(self, k):
+        """recompute the number of uncovered nodes below k"""
+        if self._cover[k]:
+            self._free[k] = 0
+        elif k >= self._size:
+            self._free[k] = self._length[k]
+        else:
+            self._free[k] = self._free[2 * k] + self._free[2 * k + 1]
+
+    def _update(self, k, lo, hi, start, end, delta):
+        if end <= lo or hi <= start:
+            return
+        if start <= lo and hi <= end:
+            self._cover[k] += delta
+        else:
+            mid = (lo + hi) // 2
+            self._update(2 * k, lo, mid, start, end, delta)
+            self._update(2 * k + 1, mid, hi, start, end, delta)
+        self._pull(k)
+
+    def cover(self, start, end):
+        """hide nodes `start` up to (excluding) `end`"""
+        self._update(1, 0, self._size, start, end, 1)
+
+    def uncover(self, start, end):
+        """undo a previous call to :meth:`cover` with the same range"""
+        self._update(1, 0, self._size, start, end, -1)
+
+    def rows(self):
+        """number of displayed nodes"""
+        return self._free[1]
+
+    def is_displayed(self, node):
+        """determine if node is not covered"""
+        k = self._size + node
+        while k:
+            if self._cover[k]:
+                return False
+            k //= 2
+        return True
+
+    def row(self, node):
+        """
+        the number of displayed nodes before node, which is the row node is
+        displayed in, or None if it is hidden
+        """
+        if not 0 <= node < self._n or not self.is_displayed(node):
+            return None
+        row = 0
+        k = self._size + node
+        while k > 1:
+            if k % 2:
+                row += self._free[k - 1]
+            k //= 2
+        return row
+
+    def node(self, row):
+        """the node displayed in given row, or None if there is none"""
+        if not 0 <= row < self._free[1]:
+            return None
+        k = 1
+        while k < self._size:
+            if self._free[2 * k] > row:
+                k = 2 * k
+            else:
+                row -= self._free[2 * k]
+                k = 2 * k + 1
+        return k - self._size
@@ -0,0 +1,259 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+
+from bisect import bisect_left, bisect_right
+
+
+def widget_text(widget):
+    """
+    text displayed by a node widget. This unwraps decorations and
+    WidgetWraps until it finds a widget with a `text` attribute, like
+    :class:`urwid.Text`, and returns an empty string if there is none.
+    """
+    seen = set()
+    while widget is not None and id(widget) not in seen:
+        seen.add(id(widget))
+        text = getattr(widget, 'text', None)
+        if text is not None:
+            return text
+        widget = getattr(widget, 'original_widget', None) or \
+            getattr(widget, '_w', None)
+    return u''
+
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TreeSearch(object):
+    """
+    Text index over the nodes of a :class:`walkers.TreeWalker`, used to
+    find the next or previous node whose text contains a query.
+
+    The index is built from the TreeWalker on first use, so no decorated
+    lines are constructed. It maps the trigrams of the node texts to the
+    nodes containing them: queries of three or more characters only check the
+    nodes that contain all trigrams of the query. Results are cached per query
+    in depth-first order, so that stepping from match to match is a binary
+    search. Changes reported by the TreeWalker are applied before the next
+    query: a replaced widget re-indexes its node, inserting or removing a node
+    re-indexes the subtree of its parent.
+    """
+    def __init__(self, walker, get_text=None, case_sensitive=False):
+        """
+        :param walker: tree to search in
+        :type walker: walkers.TreeWalker
+        :param get_text: callable that returns the text to search for a
+            position. Defaults to the text of the position's widget,
+            see :func:`widget_text`.
+        :param case_sensitive: whether matches need to have the same case
+        :type case_sensitive: bool
+        """
+        self._walker = walker
+        self._get_text = get_text or (lambda pos: widget_text(walker[pos]))
+        self._case_sensitive = case_sensitive
+        self._indexed = False
+        self._keys = {}  # position -> tuple of sibling indices from the root
+        self._texts = {}
+        self._children = {}  # position -> list of child positions
+        self._trigrams = {}  # trigram -> set of positions
+        self._results = {}  # query -> (sorted keys, positions)
+        # (position, whether its subtree changed) for reported changes
+        self._outdated = set()
+        connect = getattr(walker, 'connect_changed', None)
+        if connect is not None:
+            connect(self._on_walker_changed)
+
+    def _normalize(self, text):
+        return text if self._case_sensitive else text.lower()
+
+    # indexing
+    def _add_subtree(self, pos, key):
+        """index pos, which has given key, and all of its descendants"""
+        walker = self._walker
+        stack = [(pos, key)]
+        while stack:
+            pos, key = stack.pop()
+            self._keys[pos] = key
+            self._add_text(pos)
+            children = []
+            child = walker.first_child_position(pos)
+            while child is not None:
+                stack.append((child, key + (len(children),)))
+                children.append(child)
+                child = walker.next_sibling_position(child)
+            self._children[pos] = children
+
+    def _add_text(self, pos):
+        text = self._normalize(self._get_text(pos))
+        self._texts[pos] = text
+        for trigram in _trigrams(text):
+            self._trigrams.setdefault(trigram, set()).add(pos)
+
+    def _remove_text(self, pos):
+        for trigram in _trigrams(self._texts.pop(pos)):
+            positions = self._trigrams[trigram]
+            positions.discard(pos)
+            if not positions:
+                del self._trigrams[trigram]
+
+    def _remove_descendants(self, pos):
+        """drop all descendants of pos from the index"""
+        stack = list(self._children.get(pos, ()))
+        self._children[pos] = []
+        while stack:
+            pos = stack.pop()
+            stack.extend(self._children.pop(pos, ()))
+            del self._keys[pos]
+            self._remove_text(pos)
+
+    def _index(self):
+        if self._outdated:
+            self._refresh()
+        if self._indexed:
+            return
+        root = self._walker.root
+        index = 0
+        while root is not None:
+            self._add_subtree(root, (index,))
+            root = self._walker.next_sibling_position(root)
+            index += 1
+        self._indexed = True
+
+    def _on_walker_changed(self, pos, change):
+        if not self._indexed:
+            return
+        if change == 'widget':
+            self._outdated.add((pos, False))
+        elif change == 'appended':
+            # reindex the parents that were in the tree before
+            new = set(pos)
+            for appended in pos:
+                parent = self._walker.parent_position(appended)
+                if parent not in new:
+                    self._outdated.add((parent, True))
+        else:
+            if change != 'children':
+                # the sibling indices in the keys of pos's siblings changed
+                pos = self._walker.parent_position(pos)
+            self._outdated.add((pos, True))
+        self._results.clear()
+
+    def _refresh(self):
+        """re-index the parts of the tree reported as changed"""
+        if None in (pos for pos, subtree in self._outdated):
+            self.reindex()
+        depth = lambda item: len(self._keys.get(item[0], ()))
+        outdated = sorted(self._outdated, key=depth)
+        self._outdated.clear()
+        # drop all outdated subtrees before adding any, as nodes may have
+        # moved from one of them to another
+        subtrees = []
+        for pos, subtree in outdated:
+            if subtree and pos in self._keys:
+                self._remove_descendants(pos)
+                subtrees.append(pos)
+        for pos in subtrees:
+            if pos in self._keys:
+                self._remove_descendants(pos)
+                key = self._keys[pos]
+                children = []
+                child = self._walker.first_child_position(pos)
+                while child is not None:
+                    self._add_subtree(child, key + (len(children),))
+                    children.append(child)
+                    child = self._walker.next_sibling_position(child)
+                self._children[pos] = children
+        for pos, subtree in outdated:
+            if not subtree and pos in self._keys:
+                self._remove_text(pos)
+                self._add_text(pos)
+
+    def reindex(self):
+        """drop the index; it is rebuilt on next use"""
+        self._indexed = False
+        self._keys.clear()
+        self._texts.clear()
+        self._children.clear()
+        self._trigrams.clear()
+        self._results.clear()
+        self._outdated.clear()
+
+    # queries
+    def _matches(self, query):
+        """returns sorted keys and positions of the nodes matching query"""
+        self._index()
+        query = self._normalize(query)
+        result = self._results.get(query)
+        if result is None:
+            if len(query) < 3:
+                candidates = self._texts
+            else:
+                postings = sorted((self._trigrams.get(t, ())
+                                   for t in _trigrams(query)), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            hits = sorted((self._keys[pos], pos) for pos in candidates
+                          if query in self._texts[pos])
+            result = [key for key, pos in hits], [pos for key, pos in hits]
+            self._results[query] = result
+        return result
+
+    def matches(self, query):
+        """list of positions whose text contains query, in depth-first order"""
+        return list(self._matches(query)[1])
+
+    def next_match(self, query, pos=None, reverse=False, wrap=True):
+        """
+        position of the next match of query after pos in depth-first order,
+        or before pos if `reverse` is set. Returns None if there is no match.
+
+        :param pos: position to start from; defaults to the beginning
+        :param wrap: continue at the other end of the tree
+        :type wrap: bool
+        """
+        keys, positions = self._matches(query)
+        if not positions:
+            return None
+        key = self._keys.get(pos)
+        if reverse:
+            index = len(keys) if key is None else bisect_left(keys, key)
+            index -= 1
+            if index < 0:
+                index = len(keys) - 1 if wrap else None
+        else:
+            index = 0 if key is None else bisect_right(keys, key)
+            if index >= len(keys):
+                index = 0 if wrap else None
+        if index is None:
+            return None
+        return positions[index]
+
+    def reveal(self, listwalker, pos):
+        """
+        expand all collapsed ancestors of pos in a
+        :class:`widgets.CollapseMixin` decoration, so that pos is displayed
+        """
+        set_collapsed = getattr(listwalker, 'set_positions_collapsed', None)
+        if set_collapsed is None:
+            return
+        ancestors = []
+        parent = self._walker.parent_position(pos)
+        while parent is not None:
+            if listwalker.is_collapsed(parent):
+                ancestors.append(parent)
+            parent = self._walker.parent_position(parent)
+        set_collapsed(ancestors, False)
+
+    def jump(self, treebox, query, reverse=False):
+        """
+        move the focus of a :class:`widgets.TreeBox` to the next match of
+        query, expanding collapsed subtrees if necessary. Returns the new
+        focus position or None if nothing matches.
+        """
+        listwalker = treebox._walker
+        w, focus = listwalker.get_focus()
+        pos = self.next_match(query, focus, reverse)
+        if pos is not None:
+            self.reveal(listwalker, pos)
+            treebox.set_focus(pos)
+        return pos
@@ -0,0 +1,162 @@
+# Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
+# This file is released under the GNU LGPL, version 2.1 or a later revision.
+"""
+Compact binary file format for large read-only trees with text labels, as
+read by :class:`walkers.MmapTreeWalker`.
+
+A file starts with a header of `HEADER_SIZE` bytes: the magic string
+`MAGIC`, the format version, the number of nodes `n` and the size of the
+string table, all little-endian. It is followed by sections, each starting at
+a multiple of 8 bytes:
+
+ * six arrays of `n` 32 bit integers: for every node its parent, first child,
+   last child, next sibling and previous sibling (-1 if there is none)
+   and its depth,
+ * an array of `n + 1` 64 bit integers: the offsets of the labels in the
+   string table, followed by its size,
+ * the string table: all labels, UTF-8 encoded.
+
+Nodes are identified by their index in these arrays.
+"""
+
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+MAGIC = b'URWT'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+HEADER_SIZE = 32
+LINKS = ('parents', 'first_children', 'last_children', 'next_siblings',
+         'prev_siblings', 'depths')
+
+
+def _padded(size):
+    return (size + 7) // 8 * 8
+
+
+def section_offsets(n):
+    """
+    returns a dict that maps section names (see `LINKS`, 'label_offsets' and
+    'strings') to their offset in a file with n nodes
+    """
+    offsets = {}
+    offset = HEADER_SIZE
+    for name in LINKS:
+        offsets[name] = offset
+        offset += _padded(4 * n)
+    offsets['label_offsets'] = offset
+    offsets['strings'] = offset + 8 * (n + 1)
+    return offsets
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class TreeFileWriter(object):
+    """
+    Writes a tree file node by node. Nodes are appended as last child of
+    their parent; the links are kept in memory as compact arrays until the
+    file is closed, labels are written to a temporary file right away::
+
+        with TreeFileWriter('tree.bin') as writer:
+            root = writer.add(None, u'root')
+            writer.add(root, u'child')
+    """
+    def __init__(self, path):
+        """
+        :param path: name of the file to write
+        :type path: str
+        """
+        self._path = path
+        self._links = dict((name, array('i')) for name in LINKS)
+        self._label_offsets = array('q', [0])
+        self._strings = tempfile.TemporaryFile()
+        self._last_root = -1
+
+    def add(self, parent, label):
+        """
+        add a node with given label as last child of parent, which is a node
+        id returned earlier or None for top-level nodes. Returns the new
+        node's id.
+        """
+        links = self._links
+        node = len(links['parents'])
+        if parent is None:
+            parent = -1
+        elif not 0 <= parent < node:
+            raise ValueError('unknown parent node %r' % (parent,))
+        if parent < 0:
+            prev = self._last_root
+            depth = 0
+        else:
+            prev = links['last_children'][parent]
+            depth = links['depths'][parent] + 1
+        links['parents'].append(parent)
+        links['first_children'].append(-1)
+        links['last_children'].append(-1)
+        links['next_siblings'].append(-1)
+        links['prev_siblings'].append(prev)
+        links['depths'].append(depth)
+        if prev >= 0:
+            links['next_siblings'][prev] = node
+        elif parent >= 0:
+            links['first_children'][parent] = node
+        if parent >= 0:
+            links['last_children'][parent] = node
+        else:
+            self._last_root = node
+        data = label.encode('utf-8')
+        self._strings.write(data)
+        self._label_offsets.append(self._label_offsets[-1] + len(data))
+        return node
+
+    def close(self):
+        """write the file"""
+        n = len(self._links['parents'])
+        offsets = section_offsets(n)
+        with open(self._path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, n, self._label_offsets[-1]))
+            for name in LINKS:
+                out.seek(offsets[name])
+                _little_endian(self._links[name]).tofile(out)
+            out.seek(offsets['label_offsets'])
+            _little_endian(self._label_offsets).tofile(out)
+            out.seek(offsets['strings'])
+            self._strings.seek(0)
+            shutil.copyfileobj(self._strings, out)
+        self._strings.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._strings.close()
+
+
+def write_tree(path, treelist):
+    """
+    write a structure like the ones accepted by
+    :class:`walkers.SimpleTreeWalker`, but with strings instead of widgets,
+    to a tree file. Nodes get ids in depth-first order.
+    """
+    with TreeFileWriter(path) as writer:
+        stack = [(None, list(reversed(treelist or [])))]
+        while stack:
+            parent, pending = stack[-1]
+            if not pending:
+                stack.pop()
+                continue
+            label, children = pending.pop()
+            node = writer.add(parent, label)
+            if children:
+                stack.append((node, list(reversed(children))))
@@ -1,6 +1,25 @@
 # Copyright (C) 2012  Patrick Totzke <patricktotzke@gmail.com>
 # This file is released under the GNU LGPL, version 2.1 or a later revision.
 
+import asyncio
+import mmap
+import os
+import stat
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from timeit import default_timer
+
+from urwid import Text
+
+from caches import Cache, LRUCache
+import treefile
+
+
 class TreeWalker(object):
     """
     Content provider for tree structures. Base class for a structured walk
@@ -20,6 +39,36 @@ class TreeWalker(object):
      unspecified for the base class.
     """
     root = None
+    _change_listeners = ()
+
+    # change notification
+    def connect_changed(self, callback):
+        """
+        register a callable to be notified about changes of the tree.
+        It is called as `callback(pos, change)`, where `change` is one of
+
+         * 'children' if the children of the node at `pos` have changed,
+         * 'widget' if the widget at `pos` has been replaced,
+         * 'inserted' if the node at `pos` has been added to the tree,
+         * 'appended' if several nodes have been added as last children of
+           their parents; `pos` is the list of their positions, in the
+           order they were added,
+         * 'removed' if the node at `pos` has been taken out of the tree.
+           In this case, `parent_position` and the sibling methods still
+           answer with the former neighbours of `pos` during the callback.
+
+        Decorating :class:`TreeListWalker` objects connect themselves.
+        """
+        self._change_listeners = self._change_listeners + (callback,)
+
+    def disconnect_changed(self, callback):
+        """unregister a callable registered with :meth:`connect_changed`"""
+        self._change_listeners = tuple(
+            c for c in self._change_listeners if c != callback)
+
+    def _emit_changed(self, pos, change='children'):
+        for callback in self._change_listeners:
+            callback(pos, change)
 
     # local helper
     def _get(self, pos):
@@ -34,25 +83,27 @@ class TreeWalker(object):
 
     def _last_in_direction(self, starting_pos, direction):
         """
-        recursively move in the tree in given direction
+        move in the tree in given direction as long as possible
         and return the last position.
 
         :param starting_pos: position to start in
         :param direction: callable that transforms a position into a position.
         """
-        next_pos = direction(starting_pos)
-        if next_pos is None:
-            return starting_pos
-        else:
-            return self._last_in_direction(next_pos, direction)
+        pos = starting_pos
+        next_pos = direction(pos)
+        while next_pos is not None:
+            pos = next_pos
+            next_pos = direction(pos)
+        return pos
 
     def depth(self, pos):
         """determine depth of node at pos"""
+        depth = 0
         parent = self.parent_position(pos)
-        if parent is None:
-            return 0
-        else:
-            return self.depth(parent) + 1
+        while parent is not None:
+            depth += 1
+            parent = self.parent_position(parent)
+        return depth
 
     def first_ancestor(self, pos):
         """
@@ -103,21 +154,39 @@ class TreeWalker(object):
 
 class CachingTreeWalker(TreeWalker):
     """TreeWalker that caches its contained widgets"""
-    def __init__(self, load_widget):
+    def __init__(self, load_widget, cache_policy=None):
         """
         :param load_widget: a callable that returns a Widget for given position
+        :param cache_policy: callable that returns the cache to use for loaded
+            widgets, see :class:`caches.Cache`. Defaults to an unbounded cache.
         """
         TreeWalker.__init__(self)
-        self._content = {}
+        self._content = (cache_policy or Cache)()
         self._load_widget = load_widget
 
     def __getitem__(self, pos):
-        if pos not in self._content:
+        widget = self._content.get(pos)
+        if widget is None:
             widget = self._load_widget(pos)
             if widget is None:
                 raise IndexError
             self._content[pos] = widget
-        return self._content[pos]
+        return widget
+
+    def is_loaded(self, pos):
+        """determine if the widget for pos is cached"""
+        return pos in self._content
+
+    def preload(self, pos, widget):
+        """
+        cache a widget for pos that was constructed elsewhere, e.g. by a
+        :class:`prefetch.SubtreePrefetcher`
+        """
+        self._content[pos] = widget
+
+    def cache_stats(self):
+        """usage counters of the widget cache"""
+        return self._content.stats()
 
 
 class SimpleTreeWalker(TreeWalker):
@@ -136,15 +205,14 @@ class SimpleTreeWalker(TreeWalker):
 
     # a few local helper methods
     def _get_subtree(self, treelist, path):
-        """recursive helper to look up node-tuple for `path` in `treelist`"""
+        """helper to look up node-tuple for `path` in `treelist`"""
         subtree = None
-        if len(path) > 1:
-            subtree = self._get_subtree(treelist[path[0]][1], path[1:])
-        else:
-            try:
-                subtree = treelist[path[0]]
-            except (IndexError, TypeError):
-                pass
+        for index in path[:-1]:
+            treelist = treelist[index][1]
+        try:
+            subtree = treelist[path[-1]]
+        except (IndexError, TypeError):
+            pass
         return subtree
 
     def _get_node(self, treelist, path):
@@ -182,7 +250,7 @@ class SimpleTreeWalker(TreeWalker):
         subtree = self._get_subtree(self._treelist, pos)
         if subtree is not None:
             children = subtree[1]
-            if children is not None:
+            if children:
                 candidate = pos + (len(children) - 1,)
         return candidate
 
@@ -196,3 +264,1177 @@ class SimpleTreeWalker(TreeWalker):
     def depth(self, pos):
         """more performant implementation due to specific structure of pos"""
         return len(pos) - 1
+
+
+def _flatten_tree(treelist, with_paths=True):
+    """
+    flattens a structure as accepted by :class:`SimpleTreeWalker` into
+    parallel arrays. Nodes get dense integer ids in depth-first order and every
+    link array maps an id to the id of the related node, or -1 if none exists.
+
+    :param with_paths: whether to compute the path of every node. Otherwise,
+        `paths` is None.
+    :returns: tuple `(widgets, paths, parents, first_children, last_children,
+        next_siblings, prev_siblings, indices, depths)`, where `indices` holds
+        the index of every node among its siblings.
+    """
+    widgets, paths = [], []
+    parents, firsts, lasts = array('l'), array('l'), array('l')
+    nexts, prevs = array('l'), array('l')
+    indices, depths = array('l'), array('l')
+
+    # every stack frame holds: sibling list, index of next sibling to visit,
+    # id and path of their parent and the id of the previously visited sibling
+    stack = [[treelist or [], 0, -1, (), -1]]
+    while stack:
+        frame = stack[-1]
+        siblings, index, parent, parent_path, prev = frame
+        if index >= len(siblings):
+            stack.pop()
+            continue
+        frame[1] = index + 1
+        widget, children = siblings[index]
+        node = len(widgets)
+        path = None
+        if with_paths:
+            path = parent_path + (index,)
+            paths.append(path)
+        widgets.append(widget)
+        parents.append(parent)
+        firsts.append(-1)
+        lasts.append(-1)
+        nexts.append(-1)
+        prevs.append(prev)
+        indices.append(index)
+        depths.append(len(stack) - 1)
+        if prev >= 0:
+            nexts[prev] = node
+        elif parent >= 0:
+            firsts[parent] = node
+        if parent >= 0:
+            lasts[parent] = node
+        frame[4] = node
+        if children:
+            stack.append([children, 0, node, path, -1])
+    if not with_paths:
+        paths = None
+    return (widgets, paths, parents, firsts, lasts, nexts, prevs, indices,
+            depths)
+
+
+class IndexedSimpleTreeWalker(SimpleTreeWalker):
+    """
+    :class:`SimpleTreeWalker` that precomputes a flat index of the given
+    structure. All position methods and `__getitem__` are then a single
+    dictionary and array lookup, independent of the depth of the node.
+
+    The index reflects the structure at construction time; call :meth:`reindex`
+    after changing the underlying lists.
+    """
+    def __init__(self, treelist, **kwargs):
+        SimpleTreeWalker.__init__(self, treelist, **kwargs)
+        self.reindex()
+
+    def reindex(self):
+        """(re)build the flat index for the current structure"""
+        (self._widgets, self._paths, self._parents, self._first_children,
+         self._last_children, self._next_siblings,
+         self._prev_siblings) = _flatten_tree(self._treelist)[:7]
+        self._ids = dict((path, node) for node, path in enumerate(self._paths))
+
+    def _follow(self, links, pos):
+        """look up the position linked to pos in `links`; None if nonexistent"""
+        node = self._ids.get(pos)
+        if node is not None:
+            node = links[node]
+            if node >= 0:
+                return self._paths[node]
+        return None
+
+    # TreeWalker API
+    def __getitem__(self, pos):
+        node = self._ids.get(pos)
+        if node is not None:
+            return self._widgets[node]
+        return None
+
+    def parent_position(self, pos):
+        return self._follow(self._parents, pos)
+
+    def first_child_position(self, pos):
+        return self._follow(self._first_children, pos)
+
+    def last_child_position(self, pos):
+        return self._follow(self._last_children, pos)
+
+    def next_sibling_position(self, pos):
+        return self._follow(self._next_siblings, pos)
+
+    def prev_sibling_position(self, pos):
+        return self._follow(self._prev_siblings, pos)
+
+
+class CompactSimpleTreeWalker(SimpleTreeWalker):
+    """
+    :class:`SimpleTreeWalker` whose positions are integer node ids instead of
+    paths. Ids are assigned in depth-first order from a flat index of the
+    given structure, so moving in any direction is a single array lookup.
+    Integers are cheaper to store and to hash than path tuples, which matters
+    for deep trees, as positions are dictionary keys in all caches.
+
+    Paths as used by :class:`SimpleTreeWalker` can be converted with
+    :meth:`path` and :meth:`position`. Like for
+    :class:`IndexedSimpleTreeWalker`, :meth:`reindex` needs to be called after
+    changing the underlying lists; this assigns new ids.
+    """
+    def __init__(self, treelist, **kwargs):
+        SimpleTreeWalker.__init__(self, treelist, **kwargs)
+        self.reindex()
+
+    def reindex(self):
+        """(re)build the flat index for the current structure"""
+        (self._widgets, paths, self._parents, self._first_children,
+         self._last_children, self._next_siblings, self._prev_siblings,
+         self._indices, self._depths) = _flatten_tree(self._treelist,
+                                                      with_paths=False)
+        self.root = 0 if self._widgets else None
+
+    def _check(self, pos):
+        """reject ids that belong to no node, rather than wrapping around"""
+        if not 0 <= pos < len(self._widgets):
+            raise IndexError('unknown position %r' % (pos,))
+
+    def _follow(self, links, pos):
+        """look up the position linked to pos in `links`; None if nonexistent"""
+        self._check(pos)
+        node = links[pos]
+        return node if node >= 0 else None
+
+    def path(self, pos):
+        """the path of the node at pos, as used by :class:`SimpleTreeWalker`"""
+        self._check(pos)
+        path = []
+        while pos >= 0:
+            path.append(self._indices[pos])
+            pos = self._parents[pos]
+        return tuple(reversed(path))
+
+    def position(self, path):
+        """the position of the node at given path, or None if nonexistent"""
+        if not path:
+            return None
+        pos = self.root
+        for depth, index in enumerate(path):
+            if depth > 0:
+                pos = self.first_child_position(pos)
+            while pos is not None and index > 0:
+                pos = self.next_sibling_position(pos)
+                index -= 1
+            if pos is None:
+                break
+        return pos
+
+    # TreeWalker API
+    def __getitem__(self, pos):
+        self._check(pos)
+        return self._widgets[pos]
+
+    def parent_position(self, pos):
+        return self._follow(self._parents, pos)
+
+    def first_child_position(self, pos):
+        return self._follow(self._first_children, pos)
+
+    def last_child_position(self, pos):
+        return self._follow(self._last_children, pos)
+
+    def next_sibling_position(self, pos):
+        return self._follow(self._next_siblings, pos)
+
+    def prev_sibling_position(self, pos):
+        return self._follow(self._prev_siblings, pos)
+
+    # optimizations
+    def depth(self, pos):
+        self._check(pos)
+        return self._depths[pos]
+
+
+class TreeNode(object):
+    """node of a :class:`MutableTreeWalker`, which also serves as position"""
+    __slots__ = ('widget', 'parent', 'first_child', 'last_child',
+                 'next_sibling', 'prev_sibling')
+
+    def __init__(self, widget, parent=None):
+        self.widget = widget
+        self.parent = parent
+        self.first_child = None
+        self.last_child = None
+        self.next_sibling = None
+        self.prev_sibling = None
+
+
+class MutableTreeWalker(TreeWalker):
+    """
+    Walks on a tree that can be changed while it is displayed. Positions are
+    :class:`TreeNode` objects, which stay valid when other nodes are added or
+    removed, so every change only affects the cached lines around it.
+    Changes are reported to connected :class:`TreeListWalker` objects, see
+    :meth:`TreeWalker.connect_changed`.
+
+    Use `None` as parent to operate on the top-level nodes.
+    """
+    def __init__(self, treelist=None, **kwargs):
+        """
+        :param treelist: initial structure as accepted by
+            :class:`SimpleTreeWalker`
+        """
+        TreeWalker.__init__(self, **kwargs)
+        self.root = None
+        self._last_root = None
+        for widget, children in treelist or ():
+            self._build(None, widget, children, None)
+
+    def _build(self, parent, widget, children, before):
+        """link a new node and the nodes for its children into the tree"""
+        node = TreeNode(widget)
+        self._link(node, parent, before)
+        stack = [(node, children)]
+        while stack:
+            parent, children = stack.pop()
+            for widget, grandchildren in children or ():
+                child = TreeNode(widget)
+                self._link(child, parent, None)
+                if grandchildren:
+                    stack.append((child, grandchildren))
+        return node
+
+    def _link(self, node, parent, before):
+        """insert a detached node as child of parent, in front of before"""
+        if before is not None and before.parent is not parent:
+            raise ValueError('position to insert before is no child of parent')
+        if before is None:
+            prev = self._last_root if parent is None else parent.last_child
+        else:
+            prev = before.prev_sibling
+        node.parent = parent
+        node.prev_sibling = prev
+        node.next_sibling = before
+        if prev is not None:
+            prev.next_sibling = node
+        elif parent is not None:
+            parent.first_child = node
+        else:
+            self.root = node
+        if before is not None:
+            before.prev_sibling = node
+        elif parent is not None:
+            parent.last_child = node
+        else:
+            self._last_root = node
+
+    def _unlink(self, node):
+        """
+        take node out of the tree. It keeps its links to its former parent
+        and siblings until it is linked again.
+        """
+        parent, prev, next = node.parent, node.prev_sibling, node.next_sibling
+        if prev is not None:
+            prev.next_sibling = next
+        elif parent is not None:
+            parent.first_child = next
+        else:
+            self.root = next
+        if next is not None:
+            next.prev_sibling = prev
+        elif parent is not None:
+            parent.last_child = prev
+        else:
+            self._last_root = prev
+
+    # changing the tree
+    def insert(self, parent, widget, children=None, before=None):
+        """
+        add a node as child of parent and return its position.
+
+        :param parent: position of the parent node, None for top-level nodes
+        :param widget: widget to display for the new node
+        :param children: subtrees of the new node in the format accepted by
+            :class:`SimpleTreeWalker`
+        :param before: position of the sibling to insert the node in front
+            of. Defaults to adding it as last child.
+        """
+        node = self._build(parent, widget, children, before)
+        self._emit_changed(node, 'inserted')
+        return node
+
+    def append(self, parent, widget, children=None):
+        """add a node as last child of parent and return its position"""
+        return self.insert(parent, widget, children)
+
+    def remove(self, pos):
+        """remove the node at pos together with all of its descendants"""
+        self._unlink(pos)
+        self._emit_changed(pos, 'removed')
+
+    def move(self, pos, parent, before=None):
+        """
+        move the node at pos and its descendants to become a child of
+        parent, in front of the sibling at `before` or as last child.
+        """
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is pos:
+                raise ValueError('cannot move a node into its own subtree')
+            ancestor = ancestor.parent
+        self._unlink(pos)
+        self._emit_changed(pos, 'removed')
+        self._link(pos, parent, before)
+        self._emit_changed(pos, 'inserted')
+
+    def replace_widget(self, pos, widget):
+        """display a different widget for the node at pos"""
+        pos.widget = widget
+        self._emit_changed(pos, 'widget')
+
+    def path(self, pos):
+        """
+        tuple of sibling indices leading from the top-level to pos, like the
+        positions of :class:`SimpleTreeWalker`
+        """
+        path = []
+        while pos is not None:
+            index = 0
+            sibling = pos.prev_sibling
+            while sibling is not None:
+                index += 1
+                sibling = sibling.prev_sibling
+            path.append(index)
+            pos = pos.parent
+        return tuple(reversed(path))
+
+    def position(self, path):
+        """the position for a path as returned by :meth:`path`, or None"""
+        pos = None
+        for depth, index in enumerate(path):
+            pos = self.root if depth == 0 else pos.first_child
+            while index > 0 and pos is not None:
+                pos = pos.next_sibling
+                index -= 1
+            if pos is None:
+                break
+        return pos
+
+    # TreeWalker API
+    def __getitem__(self, pos):
+        return pos.widget
+
+    def parent_position(self, pos):
+        return pos.parent
+
+    def first_child_position(self, pos):
+        return pos.first_child
+
+    def last_child_position(self, pos):
+        return pos.last_child
+
+    def next_sibling_position(self, pos):
+        return pos.next_sibling
+
+    def prev_sibling_position(self, pos):
+        return pos.prev_sibling
+
+    # optimizations
+    def first_sibling_position(self, pos):
+        return self.root if pos.parent is None else pos.parent.first_child
+
+    def last_sibling_position(self, pos):
+        return self._last_root if pos.parent is None else pos.parent.last_child
+
+
+class LoadingPosition(object):
+    """
+    position of the placeholder node an :class:`AsyncTreeWalker` displays
+    as only child of `parent` while the actual children are loading.
+    """
+    __slots__ = ('parent',)
+
+    def __init__(self, parent):
+        self.parent = parent
+
+
+class AsyncTreeWalker(CachingTreeWalker):
+    """
+    TreeWalker for slow backends that loads the children of nodes in
+    background threads, so that expensive lookups never block rendering or
+    input handling. Until the children of a node are known, it gets a
+    single placeholder child at a :class:`LoadingPosition`.
+    Once they arrive, connected :class:`TreeListWalker` objects are notified
+    and emit their `modified` signal.
+
+    Subclasses need to implement :meth:`load_children`, which is called
+    in worker threads, and :meth:`load_widget`. Positions need to be hashable
+    and unique within the tree.
+    """
+    def __init__(self, root, loop=None, executor=None, max_workers=4,
+                 cache_policy=None):
+        """
+        :param root: position of the root node
+        :param loop: main loop the tree is displayed in. Results are handed
+            over to its thread via :meth:`urwid.MainLoop.watch_pipe`.
+            Without a loop, they are applied in the worker threads, which is
+            only safe if nothing is rendered concurrently.
+        :type loop: urwid.MainLoop
+        :param executor: executor to submit loading jobs to. Defaults to a
+            thread pool with `max_workers` threads.
+        :type executor: concurrent.futures.Executor
+        :param cache_policy: cache policy for loaded widgets,
+            see :class:`CachingTreeWalker`
+        """
+        CachingTreeWalker.__init__(self, self.load_widget,
+                                   cache_policy=cache_policy)
+        self.root = root
+        self._children = {}  # position -> list of child positions or None
+        self._parents = {}
+        self._indices = {}  # position -> index in list of siblings
+        self._pending = {}  # position -> placeholder of loading children
+        self._executor = executor or ThreadPoolExecutor(max_workers)
+        self._loop = loop
+        self._errors = {}  # position -> exception raised loading children
+        self._lock = threading.Lock()
+        self._results = []
+        self._closed = False
+        self._pipe = None
+        if loop is not None:
+            self._pipe = loop.watch_pipe(self._apply_results)
+
+    # To be overwritten by subclasses
+    def load_children(self, pos):
+        """
+        returns the list of child positions of the node at pos, or None if it
+        has no children. This is called in a worker thread.
+        """
+        return None
+
+    def load_widget(self, pos):
+        """returns the widget to display for the node at pos"""
+        return None
+
+    def may_have_children(self, pos):
+        """
+        cheap check if the node at pos may have children at all. Nodes for
+        which this returns False are never loaded and show no placeholder.
+        """
+        return True
+
+    def load_placeholder(self, parent):
+        """returns the widget to display while the children of parent load"""
+        return Text(u'\u2026')
+
+    # loading
+    def _request(self, pos):
+        """start loading the children of pos and return their placeholder"""
+        placeholder = self._pending.get(pos)
+        if placeholder is None:
+            placeholder = LoadingPosition(pos)
+            self._pending[pos] = placeholder
+            future = self._executor.submit(self.load_children, pos)
+            future.add_done_callback(
+                lambda future: self._deliver(pos, future))
+        return placeholder
+
+    def _deliver(self, pos, future):
+        """hand over loaded children to the thread that displays the tree"""
+        children = error = None
+        try:
+            children = future.result()
+        except Exception as e:
+            error = e
+        with self._lock:
+            if self._closed:
+                return
+            if self._pipe is not None:
+                self._results.append((pos, children, error))
+                os.write(self._pipe, b'.')
+                return
+        self._apply(pos, children, error)
+
+    def _apply_results(self, data):
+        """watch_pipe callback; applies all results delivered so far"""
+        with self._lock:
+            results, self._results = self._results, []
+        for pos, children, error in results:
+            self._apply(pos, children, error)
+        return True
+
+    def _apply(self, pos, children, error=None):
+        self._pending.pop(pos, None)
+        children = list(children) if children else None
+        self._children[pos] = children
+        if error is not None:
+            self._errors[pos] = error
+        for index, child in enumerate(children or ()):
+            self._parents[child] = pos
+            self._indices[child] = index
+        self._emit_changed(pos)
+
+    def _child_list(self, pos):
+        """children of pos if known, otherwise start loading them"""
+        if isinstance(pos, LoadingPosition):
+            return None
+        if pos in self._children:
+            return self._children[pos]
+        if not self.may_have_children(pos):
+            return None
+        return [self._request(pos)]
+
+    def load_error(self, pos):
+        """
+        the exception :meth:`load_children` raised for pos, in which case the
+        node is displayed without children, or None
+        """
+        return self._errors.get(pos)
+
+    def reload(self, pos):
+        """forget the children of pos and load them again"""
+        self._errors.pop(pos, None)
+        for child in self._children.pop(pos, None) or ():
+            self._parents.pop(child, None)
+            self._indices.pop(child, None)
+        self._request(pos)
+        self._emit_changed(pos)
+
+    def close(self):
+        """stop accepting results and shut down the executor"""
+        with self._lock:
+            self._closed = True
+            self._results = []
+            if self._pipe is not None:
+                self._loop.remove_watch_pipe(self._pipe)
+                os.close(self._pipe)
+                self._pipe = None
+        self._executor.shutdown(wait=False)
+
+    # TreeWalker API
+    def __getitem__(self, pos):
+        if isinstance(pos, LoadingPosition):
+            return self.load_placeholder(pos.parent)
+        return CachingTreeWalker.__getitem__(self, pos)
+
+    def parent_position(self, pos):
+        if isinstance(pos, LoadingPosition):
+            return pos.parent
+        return self._parents.get(pos)
+
+    def first_child_position(self, pos):
+        children = self._child_list(pos)
+        return children[0] if children else None
+
+    def last_child_position(self, pos):
+        children = self._child_list(pos)
+        return children[-1] if children else None
+
+    def next_sibling_position(self, pos):
+        return self._sibling(pos, 1)
+
+    def prev_sibling_position(self, pos):
+        return self._sibling(pos, -1)
+
+    def _sibling(self, pos, offset):
+        candidate = None
+        siblings = self._children.get(self._parents.get(pos))
+        if siblings and pos in self._indices:
+            index = self._indices[pos] + offset
+            if 0 <= index < len(siblings):
+                candidate = siblings[index]
+        return candidate
+
+
+class StreamingTreeWalker(TreeWalker):
+    """
+    Builds a tree from a stream of records while it is displayed. Every
+    record is a tuple `(parent, widget)`, where parent is the position of a
+    previous record or None for a top-level node. Positions are the
+    sequence numbers of the records, starting at 0, and nodes are always
+    appended as last child of their parent.
+
+    Given a main loop, records are attached in chunks from alarm callbacks, so
+    nodes show up as soon as they arrive and input is handled in between.
+    Connected :class:`TreeListWalker` objects are notified once per chunk.
+    Records are read ahead into a buffer of at most `max_buffered` records,
+    so a fast producer cannot fill up memory: plain iterables in a
+    background thread, which may block while waiting for data, asynchronous
+    ones in the asyncio loop. If reading fails, the stream ends and the
+    exception is available from :meth:`read_error`.
+    """
+    def __init__(self, records, loop=None, chunk_size=256, time_budget=0.01,
+                 max_buffered=4096):
+        """
+        :param records: iterable or asynchronous iterable of records.
+            Asynchronous iterables require a loop with an
+            :class:`urwid.AsyncioEventLoop`.
+        :param loop: main loop the tree is displayed in. Without a loop,
+            records are only attached by calling :meth:`pump`, which takes
+            them from a plain iterable directly, so it must not block.
+        :type loop: urwid.MainLoop
+        :param chunk_size: maximal number of records attached per callback
+        :type chunk_size: int
+        :param time_budget: maximal number of seconds spent per callback
+        :type time_budget: float
+        :param max_buffered: maximal number of records read ahead
+        :type max_buffered: int
+        """
+        TreeWalker.__init__(self)
+        self.root = None
+        self._last_root = -1
+        self._widgets = []
+        self._parents = array('l')
+        self._first_children = array('l')
+        self._last_children = array('l')
+        self._next_siblings = array('l')
+        self._prev_siblings = array('l')
+
+        self._loop = loop
+        self._chunk_size = chunk_size
+        self._time_budget = time_budget
+        self._max_buffered = max_buffered
+        self._buffer = deque()
+        self._exhausted = False
+        self._error = None
+        self._scheduled = False
+        self._records = None  # iterable read directly by pump
+        self._drained = None  # set when an asynchronous reader may continue
+        self._space = threading.Condition()  # for the reader thread
+        self._wakeup_pending = False
+        self._closed = False
+        self._pipe = None
+        if hasattr(records, '__aiter__'):
+            if loop is None:
+                raise ValueError('asynchronous records require a main loop')
+            self._drained = asyncio.Event()
+            loop.set_alarm_in(0, self._start_reading, records)
+        elif loop is not None:
+            self._pipe = loop.watch_pipe(self._on_records)
+            reader = threading.Thread(target=self._read_in_thread,
+                                      args=(records,))
+            reader.daemon = True
+            reader.start()
+        else:
+            self._records = iter(records)
+
+    # consuming records
+    def _start_reading(self, loop, records):
+        """alarm callback that starts reading in the running asyncio loop"""
+        asyncio.ensure_future(self._read_ahead(records))
+
+    async def _read_ahead(self, records):
+        """move records from an asynchronous iterable to the buffer"""
+        try:
+            async for record in records:
+                while len(self._buffer) >= self._max_buffered:
+                    self._drained.clear()
+                    await self._drained.wait()
+                if self._closed:
+                    return
+                self._buffer.append(record)
+                self._schedule()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._exhausted = True
+            self._schedule()
+
+    def _read_in_thread(self, records):
+        """move records from an iterable to the buffer; runs in a thread"""
+        try:
+            for record in records:
+                with self._space:
+                    while len(self._buffer) >= self._max_buffered and \
+                            not self._closed:
+                        self._space.wait()
+                    if self._closed:
+                        return
+                    self._buffer.append(record)
+                    self._wake_up()
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._space:
+                self._exhausted = True
+                if not self._closed:
+                    self._wake_up()
+
+    def _wake_up(self):
+        """make the main loop attach records; called holding `_space`"""
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            os.write(self._pipe, b'.')
+
+    def _on_records(self, data):
+        """watch_pipe callback of the reader thread"""
+        with self._space:
+            self._wakeup_pending = False
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        """make sure records are attached in the next loop iteration"""
+        if self._loop is not None and not self._scheduled and \
+                not self._closed:
+            self._scheduled = True
+            self._loop.set_alarm_in(0, self._attach_chunk)
+
+    def _attach_chunk(self, loop=None, user_data=None):
+        self._scheduled = False
+        if self._closed:
+            return
+        self.pump(self._chunk_size, self._time_budget)
+        # let the reader fill the buffer again
+        if self._drained is not None:
+            self._drained.set()
+        else:
+            with self._space:
+                self._space.notify()
+        if self._buffer:
+            self._schedule()
+
+    def _next_record(self):
+        """the next record that is available right now, or None"""
+        if self._buffer:
+            return self._buffer.popleft()
+        if self._records is not None and not self._exhausted:
+            try:
+                record = next(self._records, None)
+            except Exception as e:
+                self._error = e
+                self._exhausted = True
+                raise
+            if record is not None:
+                return record
+            self._exhausted = True
+        return None
+
+    def pump(self, n=None, time_budget=None):
+        """
+        attach up to `n` records that are available right now, or all of
+        them, and return the number of attached records. Connected
+        :class:`TreeListWalker` objects are notified once, afterwards.
+
+        :param time_budget: stop after this many seconds
+        :type time_budget: float
+        """
+        added = []
+        start = default_timer()
+        try:
+            while n is None or len(added) < n:
+                record = self._next_record()
+                if record is None:
+                    break
+                parent, widget = record
+                added.append(self._attach(parent, widget))
+                if time_budget is not None and \
+                        default_timer() - start >= time_budget:
+                    break
+        finally:
+            if added:
+                self._emit_changed(added, 'appended')
+        return len(added)
+
+    def is_complete(self):
+        """
+        determine if all records have been attached. This is also the case
+        if reading them failed, see :meth:`read_error`.
+        """
+        return self._exhausted and not self._buffer
+
+    def read_error(self):
+        """the exception that ended reading the records, or None"""
+        return self._error
+
+    def close(self):
+        """stop reading and attaching records"""
+        with self._space:
+            self._closed = True
+            self._space.notify()
+            if self._pipe is not None:
+                self._loop.remove_watch_pipe(self._pipe)
+                os.close(self._pipe)
+                self._pipe = None
+        if self._drained is not None:
+            self._drained.set()
+        self._buffer.clear()
+
+    def add(self, parent, widget):
+        """append a node as last child of parent and return its position"""
+        pos = self._attach(parent, widget)
+        self._emit_changed(pos, 'inserted')
+        return pos
+
+    def _attach(self, parent, widget):
+        """append a node without notifying listeners"""
+        pos = len(self._widgets)
+        if parent is None:
+            parent = -1
+        elif not 0 <= parent < pos:
+            raise ValueError('unknown parent position %r' % (parent,))
+        prev = self._last_root if parent < 0 else self._last_children[parent]
+        self._widgets.append(widget)
+        self._parents.append(parent)
+        self._first_children.append(-1)
+        self._last_children.append(-1)
+        self._next_siblings.append(-1)
+        self._prev_siblings.append(prev)
+        if prev >= 0:
+            self._next_siblings[prev] = pos
+        elif parent >= 0:
+            self._first_children[parent] = pos
+        else:
+            self.root = pos
+        if parent >= 0:
+            self._last_children[parent] = pos
+        else:
+            self._last_root = pos
+        return pos
+
+    def __len__(self):
+        return len(self._widgets)
+
+    # TreeWalker API
+    def _check(self, pos):
+        """reject positions of nodes that have not been attached"""
+        if not 0 <= pos < len(self._widgets):
+            raise IndexError('unknown position %r' % (pos,))
+
+    def _follow(self, links, pos):
+        self._check(pos)
+        linked = links[pos]
+        return linked if linked >= 0 else None
+
+    def __getitem__(self, pos):
+        self._check(pos)
+        return self._widgets[pos]
+
+    def parent_position(self, pos):
+        return self._follow(self._parents, pos)
+
+    def first_child_position(self, pos):
+        return self._follow(self._first_children, pos)
+
+    def last_child_position(self, pos):
+        return self._follow(self._last_children, pos)
+
+    def next_sibling_position(self, pos):
+        return self._follow(self._next_siblings, pos)
+
+    def prev_sibling_position(self, pos):
+        return self._follow(self._prev_siblings, pos)
+
+
+class _Listing(object):
+    """cached directory listing as used by :class:`FilesystemTreeWalker`"""
+    __slots__ = ('mtime', 'checked', 'entries', 'indices', 'directories')
+
+    def __init__(self, mtime, checked, entries, directories=None):
+        self.mtime = mtime
+        self.checked = checked
+        self.entries = entries
+        self.indices = None
+        if entries is not None:
+            self.indices = dict((e, i) for i, e in enumerate(entries))
+        # entries that are directories; None if this is no directory
+        self.directories = directories
+
+
+# listing of everything that is not a directory; never cached
+_NO_LISTING = _Listing(None, 0, None)
+
+
+def _is_dir_entry(entry):
+    """determine if a DirEntry may be a directory"""
+    try:
+        return entry.is_dir()
+    except OSError:
+        return True
+
+
+class FilesystemTreeWalker(CachingTreeWalker):
+    """
+    Walks the local filesystem. Positions are absolute paths.
+
+    The sorted listing of every visited directory is cached together with
+    the index of each entry, so moving between siblings is a dictionary
+    lookup, and with the entries that are directories, so files are never
+    looked up or cached themselves. Navigation only ever reads cached listings; they are checked
+    against the directories' modification times by :meth:`revalidate`,
+    which lists changed directories again and notifies connected
+    :class:`TreeListWalker` objects. Given a main loop, this happens every
+    `revalidate_interval` seconds, or whenever the loop is idle if the
+    interval is 0. At most `max_listings` listings are cached; this should
+    exceed the number of directories displayed at once.
+    """
+    def __init__(self, load_widget, root=None, revalidate_interval=1.0,
+                 cache_policy=None, loop=None, max_listings=1024):
+        """
+        :param load_widget: a callable that returns a Widget for given path
+        :param root: path of the root node. Defaults to the filesystem root.
+        :type root: str
+        :param revalidate_interval: number of seconds a listing is used
+            without checking the directory's modification time
+        :type revalidate_interval: float
+        :param cache_policy: cache policy for loaded widgets,
+            see :class:`CachingTreeWalker`
+        :param loop: main loop the tree is displayed in, see :meth:`watch`.
+            Without a loop, call :meth:`revalidate`.
+        :type loop: urwid.MainLoop
+        :param max_listings: maximal number of cached directory listings
+        :type max_listings: int
+        """
+        CachingTreeWalker.__init__(self, load_widget,
+                                   cache_policy=cache_policy)
+        if root is None:
+            drive, _ = os.path.splitdrive(os.getcwd())
+            root = drive + os.path.sep
+        self.root = root
+        self._revalidate_interval = revalidate_interval
+        self._listings = LRUCache(max_entries=max_listings)
+        self._loop = None
+        self._alarm = None
+        self._idle_handle = None
+        if loop is not None:
+            self.watch(loop)
+
+    def _read_listing(self, path):
+        """list the directory at path"""
+        try:
+            st = os.stat(path)
+            mtime = st.st_mtime
+            is_dir = stat.S_ISDIR(st.st_mode)
+        except OSError:
+            mtime, is_dir = None, False
+        if not is_dir:
+            return _NO_LISTING
+        entries = None
+        directories = set()
+        try:
+            with os.scandir(path) as found:
+                found = list(found)
+            entries = sorted(entry.path for entry in found)
+            directories.update(entry.path for entry in found
+                               if _is_dir_entry(entry))
+        except OSError:
+            pass
+        return _Listing(mtime, time.monotonic(), entries, directories)
+
+    def _listing(self, path):
+        """
+        returns the cached listing for path. Only directories are cached;
+        paths their parent's listing knows not to be directories are not
+        even looked up.
+        """
+        listing = self._listings.get(path)
+        if listing is None:
+            parent = self.parent_position(path)
+            if parent in self._listings and \
+                    path not in self._listings[parent].directories:
+                return _NO_LISTING
+            listing = self._read_listing(path)
+            if listing is not _NO_LISTING:
+                self._listings[path] = listing
+        return listing
+
+    def revalidate(self, paths=None):
+        """
+        check the cached listings of the directories at paths, or of all
+        directories, whose last check is at least `revalidate_interval`
+        seconds ago. Changed directories are listed again and reported to
+        connected :class:`TreeListWalker` objects.
+
+        :param paths: paths of directories to check, e.g. the ones displayed
+        """
+        if paths is None:
+            paths = list(self._listings)
+        now = time.monotonic()
+        changed = []
+        for path in paths:
+            if path not in self._listings:
+                continue
+            listing = self._listings[path]
+            if now - listing.checked < self._revalidate_interval:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            listing.checked = now
+            if listing.mtime != mtime:
+                changed.append(path)
+        # notify only after all checks, so listeners see a consistent tree
+        for path in changed:
+            listing = self._read_listing(path)
+            if listing is _NO_LISTING:
+                self._listings.pop(path)
+            else:
+                self._listings[path] = listing
+        for path in changed:
+            self._emit_changed(path)
+        return changed
+
+    def watch(self, loop):
+        """
+        revalidate listings in main loop `loop` every `revalidate_interval`
+        seconds, or whenever it is idle if the interval is 0
+        """
+        self.close()
+        self._loop = loop
+        if self._revalidate_interval > 0:
+            self._alarm = loop.set_alarm_in(self._revalidate_interval,
+                                            self._on_alarm)
+        else:
+            self._idle_handle = loop.event_loop.enter_idle(self.revalidate)
+
+    def _on_alarm(self, loop=None, user_data=None):
+        self.revalidate()
+        self._alarm = self._loop.set_alarm_in(self._revalidate_interval,
+                                              self._on_alarm)
+
+    def close(self):
+        """stop revalidating listings in the main loop"""
+        if self._alarm is not None:
+            self._loop.remove_alarm(self._alarm)
+            self._alarm = None
+        if self._idle_handle is not None:
+            self._loop.event_loop.remove_enter_idle(self._idle_handle)
+            self._idle_handle = None
+
+    def _sibling(self, pos, offset):
+        candidate = None
+        parent = self.parent_position(pos)
+        if parent is not None:
+            listing = self._listing(parent)
+            if listing.entries is not None and pos in listing.indices:
+                index = listing.indices[pos] + offset
+                if 0 <= index < len(listing.entries):
+                    candidate = listing.entries[index]
+        return candidate
+
+    # TreeWalker API
+    def parent_position(self, pos):
+        parent = None
+        if pos != self.root:
+            parent = os.path.dirname(pos)
+            if parent == pos:
+                parent = None
+        return parent
+
+    def first_child_position(self, pos):
+        entries = self._listing(pos).entries
+        return entries[0] if entries else None
+
+    def last_child_position(self, pos):
+        entries = self._listing(pos).entries
+        return entries[-1] if entries else None
+
+    def next_sibling_position(self, pos):
+        return self._sibling(pos, 1)
+
+    def prev_sibling_position(self, pos):
+        return self._sibling(pos, -1)
+
+
+class MmapTreeWalker(CachingTreeWalker):
+    """
+    Walks a tree file as written by :mod:`treefile`, which is memory-mapped
+    instead of read. Positions are node ids; every move reads a single
+    integer from the mapping, so opening even huge trees is instant and only
+    the pages of the displayed nodes are loaded.
+
+    Widgets are only constructed for nodes that are displayed, and by default
+    only those of the most recently displayed nodes are kept.
+    """
+    def __init__(self, path, load_widget=Text,
+                 cache_policy=partial(LRUCache, max_entries=2000)):
+        """
+        :param path: name of the tree file
+        :type path: str
+        :param load_widget: callable that constructs the widget for a label
+        :param cache_policy: cache policy for loaded widgets,
+            see :class:`CachingTreeWalker`
+        """
+        CachingTreeWalker.__init__(self, self._load_widget,
+                                   cache_policy=cache_policy)
+        self._load_label_widget = load_widget
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, strings_size = treefile.HEADER.unpack_from(
+            self._map)
+        if magic != treefile.MAGIC or version != treefile.VERSION:
+            raise ValueError('%s is no tree file of version %d' %
+                             (path, treefile.VERSION))
+        offsets = treefile.section_offsets(n)
+        for name in treefile.LINKS:
+            setattr(self, '_' + name,
+                    self._section(offsets[name], n, 'i'))
+        self._label_offsets = self._section(offsets['label_offsets'], n + 1,
+                                            'q')
+        self._strings = offsets['strings']
+        self._size = n
+        self.root = 0 if n else None
+
+    def _section(self, offset, length, typecode):
+        """a sequence of integers of given type that is stored at offset"""
+        values = array(typecode)
+        end = offset + length * values.itemsize
+        if sys.byteorder != 'little':
+            values.frombytes(self._map[offset:end])
+            values.byteswap()
+            return values
+        return memoryview(self._map)[offset:end].cast(typecode)
+
+    def _follow(self, links, pos):
+        node = links[pos]
+        return node if node >= 0 else None
+
+    def _load_widget(self, pos):
+        return self._load_label_widget(self.label(pos))
+
+    def __len__(self):
+        return self._size
+
+    def label(self, pos):
+        """the label of the node at pos, without constructing its widget"""
+        start = self._strings + self._label_offsets[pos]
+        end = self._strings + self._label_offsets[pos + 1]
+        return self._map[start:end].decode('utf-8')
+
+    def close(self):
+        """release the mapping"""
+        for name in treefile.LINKS + ('label_offsets',):
+            section = getattr(self, '_' + name)
+            if isinstance(section, memoryview):
+                section.release()
+        self._map.close()
+
+    # TreeWalker API
+    def __getitem__(self, pos):
+        if not 0 <= pos < self._size:
+            raise IndexError(pos)
+        return CachingTreeWalker.__getitem__(self, pos)
+
+    def parent_position(self, pos):
+        return self._follow(self._parents, pos)
+
+    def first_child_position(self, pos):
+        return self._follow(self._first_children, pos)
+
+    def last_child_position(self, pos):
+        return self._follow(self._last_children, pos)
+
+    def next_sibling_position(self, pos):
+        return self._follow(self._next_siblings, pos)
+
+    def prev_sibling_position(self, pos):
+        return self._follow(self._prev_siblings, pos)
+
+    # optimizations
+    def depth(self, pos):
+        return self._depths[pos]
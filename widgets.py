@@ -5,6 +5,9 @@ import urwid
 from urwid import AttrMap, Text, WidgetWrap, ListBox, Columns, SolidFill
 from urwid import signals
 
+from caches import Cache
+from rowindex import RowIndex
+
 
 class TreeDecorationError(Exception):
     pass
@@ -16,6 +19,12 @@ class TreeListWalker(urwid.ListWalker):
     Objects of this type wrap a given TreeWalker and turn it into
     a ListWalker compatible with ListBox.
     """
+    # number of positions :meth:`positions` computes at once
+    _walk_batch_size = 64
+    # incremented whenever the TreeWalker reports changes, so that
+    # data derived from the tree structure can be recognized as outdated
+    _tree_version = 0
+
     def __init__(self, treewalker, focus=None, **kwargs):
         """
         :param treewalker: the tree of widgets to be displayed
@@ -26,6 +35,18 @@ class TreeListWalker(urwid.ListWalker):
         """
         self._walker = treewalker
         self._focus = focus or treewalker.root
+        connect = getattr(treewalker, 'connect_changed', None)
+        if connect is not None:
+            connect(self._on_walker_changed)
+
+    def detach(self):
+        """
+        stop following changes of the TreeWalker, so that a decoration that
+        is no longer displayed is not kept alive by it
+        """
+        disconnect = getattr(self._walker, 'disconnect_changed', None)
+        if disconnect is not None:
+            disconnect(self._on_walker_changed)
 
     def __getitem__(self, pos):
         return self._walker[pos]
@@ -48,20 +69,119 @@ class TreeListWalker(urwid.ListWalker):
         """
         candidate = None
         parent = self.parent_position(pos)
-        if parent is not None:
+        while parent is not None:
             candidate = self.next_sibling_position(parent)
-            if candidate is None:
-                candidate = self._next_of_kin(parent)
+            if candidate is not None:
+                break
+            parent = self.parent_position(parent)
         return candidate
 
     def _last_decendant_position(self, pos):
         """Looks up the last node in the subtree starting a pos."""
-        candidate = pos
         last_child = self.last_child_position(pos)
-        if last_child is not None:
-            candidate = self._last_decendant_position(last_child)
+        while last_child is not None:
+            pos = last_child
+            last_child = self.last_child_position(pos)
+        return pos
+
+    def _position_after_subtree(self, pos):
+        """the position following the subtree starting at pos in DF-order"""
+        candidate = self.next_sibling_position(pos)
+        if candidate is None:
+            candidate = self._next_of_kin(pos)
         return candidate
 
+    def _on_walker_changed(self, pos, change):
+        """called by the TreeWalker whenever the tree changed at pos"""
+        self._tree_version += 1
+        if change == 'children':
+            self.invalidate_subtree(pos)
+        elif change == 'widget':
+            self.invalidate_line(pos)
+        elif change in ('inserted', 'appended'):
+            if change == 'inserted':
+                self.invalidate_insertion(pos)
+            else:
+                self.invalidate_appended(pos)
+            if self._focus is None:
+                self.set_focus(self._first_root_position())
+        elif change == 'removed':
+            self._move_focus_from_removed(pos)
+            self.invalidate_removal(pos)
+        signals.emit_signal(self, "modified")
+
+    def _move_focus_from_removed(self, pos):
+        """
+        if the focus was in the subtree of the removed pos, move it to a
+        sibling or the parent of pos
+        """
+        ancestor = self._focus
+        while ancestor is not None and ancestor != pos:
+            ancestor = self._walker.parent_position(ancestor)
+        if ancestor is None:
+            return
+        newfocus = self.next_sibling_position(pos)
+        if newfocus is None:
+            newfocus = self.prev_sibling_position(pos)
+        if newfocus is None:
+            newfocus = self.parent_position(pos)
+        self.set_focus(newfocus)
+
+    def invalidate_children(self, pos):
+        """
+        notifies this walker that the children of pos, as seen through
+        this walker, have changed. Subclasses that cache data derived from the
+        tree structure must drop what depends on them.
+        """
+        pass
+
+    def invalidate_subtree(self, pos):
+        """
+        notifies this walker that the whole subtree below pos may have been
+        replaced in the underlying TreeWalker.
+        """
+        pass
+
+    def invalidate_line(self, pos):
+        """
+        notifies this walker that the widget at pos has been replaced in the
+        underlying TreeWalker.
+        """
+        pass
+
+    def invalidate_insertion(self, pos):
+        """
+        notifies this walker that pos has been added to the underlying
+        TreeWalker.
+        """
+        pass
+
+    def invalidate_removal(self, pos):
+        """
+        notifies this walker that pos has been removed from the underlying
+        TreeWalker, which still reports its former parent and siblings.
+        """
+        pass
+
+    def invalidate_appended(self, positions):
+        """
+        notifies this walker that the given positions have been added as
+        last children of their parents to the underlying TreeWalker.
+        """
+        pass
+
+    def _first_appended(self, positions):
+        """
+        the first of the appended positions among the children of each
+        parent that was in the tree before; only these have neighbours
+        whose cached data may refer to the tree without the new nodes.
+        """
+        walker = self._walker
+        new = set(positions)
+        return [pos for pos in positions
+                if walker.parent_position(pos) not in new and
+                walker.prev_sibling_position(pos) not in new]
+
     # List Walker API.
     def get_focus(self):
         return self._get(self._focus)
@@ -99,16 +219,50 @@ class TreeListWalker(urwid.ListWalker):
                     candidate = parent
         return candidate
 
+    def _first_root_position(self):
+        """the first top-level position displayed by this walker"""
+        return self._walker.root
+
+    def _last_root_position(self):
+        """the last top-level position displayed by this walker"""
+        root = self._walker.root
+        if root is None:
+            return None
+        return self._walker.last_sibling_position(root)
+
     def positions(self, reverse=False):
-        pos = self._walker.root
+        pos = self._first_root_position()
         nextpos = self.next_position
         if reverse:
-            lastroot = self._walker.last_sibling_position(self._walker.root)
-            pos = self._walker.last_decendant(lastroot)
+            lastroot = self._last_root_position()
+            if lastroot is not None:
+                pos = self._last_decendant_position(lastroot)
             nextpos = self.prev_position
+        batch = [pos] if pos is not None else []
+        while batch:
+            for pos in batch:
+                yield pos
+            batch = self.walk(pos, self._walk_batch_size, nextpos)
+
+    def walk(self, start, n, direction=None):
+        """
+        returns a list of the (up to) `n` positions following `start`
+        in depth-first order.
+
+        :param direction: callable that transforms a position into the next
+            one. Defaults to :meth:`next_position`; use :meth:`prev_position`
+            to walk backwards.
+        """
+        step = direction or self.next_position
+        result = []
+        append = result.append
+        pos = step(start) if n > 0 else None
         while pos is not None:
-            yield pos
-            pos = nextpos(pos)
+            append(pos)
+            if len(result) >= n:
+                break
+            pos = step(pos)
+        return result
     # end of List Walker API
 
     # Tree Walker API.
@@ -145,23 +299,69 @@ class TreeBox(WidgetWrap):
     """
     _selectable = True
 
-    def __init__(self, walker, **kwargs):
+    def __init__(self, walker, visible_margin=None, profiler=None, **kwargs):
         """
         :param walker: tree of widgets to be displayed.
             In case we are given a raw `TreeWalker`, it will be used though
             `TreeListWalker` which means no decoration.
         :type walker: TreeWalker or TreeListWalker
+        :param visible_margin: if given, the walker only keeps the lines
+            currently displayed and this many positions above and below them
+            in its caches. All other lines are released after rendering and
+            rebuilt when needed again, and so are spacers and other data
+            memoized per position. Row counts of collapsible decorations
+            are kept, as they are per subtree and computed on demand. This requires a walker with
+            :meth:`CachingMixin.retain_lines`. The shared widgets of its
+            :class:`DecorationPool` are kept; their number only depends on
+            the decoration's options, not on the size of the tree.
+        :type visible_margin: int
+        :param profiler: if given, it records every rendered frame
+        :type profiler: instrumentation.FrameProfiler
         """
         if not isinstance(walker, TreeListWalker):
             walker = TreeListWalker(walker)
         self._walker = walker
+        self._visible_margin = visible_margin
         self._outer_list = ListBox(walker)
         self.__super.__init__(self._outer_list)
+        if profiler is not None:
+            profiler.instrument_treebox(self)
+
+    def _release_invisible_lines(self, size, focus):
+        """drop cached lines outside the displayed rows and their margin"""
+        retain_lines = getattr(self._walker, 'retain_lines', None)
+        if retain_lines is None:
+            return
+        middle, top, bottom = self._outer_list.calculate_visible(size, focus)
+        if middle is None:
+            return
+        above = [pos for w, pos, rows in top[1]]
+        below = [pos for w, pos, rows in bottom[1]]
+        focuspos = middle[2]
+        first = above[-1] if above else focuspos
+        last = below[-1] if below else focuspos
+        margin = self._visible_margin
+        positions = set(above)
+        positions.add(focuspos)
+        positions.update(below)
+        positions.update(
+            self._walker.walk(first, margin, self._walker.prev_position))
+        positions.update(self._walker.walk(last, margin))
+        retain_lines(positions)
 
     # Widget API
     def get_focus(self):
         return self._outer_list.get_focus()
 
+    def set_focus(self, pos):
+        self._outer_list.set_focus(pos)
+
+    def render(self, size, focus=False):
+        canvas = self.__super.render(size, focus)
+        if self._visible_margin is not None:
+            self._release_invisible_lines(size, focus)
+        return canvas
+
     def keypress(self, size, key):
         key = self._outer_list.keypress(size, key)
         if key in ['left', 'right', '[', ']', '-', '+', 'C', 'E']:
@@ -219,26 +419,295 @@ class TreeBox(WidgetWrap):
 
 NO_SPACE_MSG = 'too little space for requested decoration'
 
+
+class TreeLineWidget(urwid.Widget):
+    """
+    Flow widget for one line of a decorated tree: the widget of a node to the
+    right of its decoration. Instead of composing a widget per decoration
+    column, the decoration is given as compact description and rendered
+    straight into a single canvas. Only the node widget is rendered as usual.
+
+    It looks and behaves like a :class:`urwid.Columns` of the decoration
+    columns as box widgets and the node widget.
+    """
+    _sizing = frozenset(['flow'])
+
+    def __init__(self, prefix, widget):
+        """
+        :param prefix: decoration columns as list of tuples `(width,
+            first_row, other_row)`. Rows are lists of `(attribute, charset,
+            text)` runs as yielded by :meth:`urwid.Canvas.content`.
+            The first row is shown next to the first row of the node widget,
+            the other row is repeated for all rows below.
+        :param widget: the widget of the node
+        :type widget: urwid.Widget
+        """
+        self.original_widget = widget
+        self._prefix = prefix
+        self._width = sum(width for width, first, other in prefix)
+        self._first = self._join_runs(first for w, first, o in prefix)
+        self._other = self._join_runs(other for w, f, other in prefix)
+
+    @staticmethod
+    def _join_runs(rows):
+        """merge rows of runs into the text, attr and cs of a TextCanvas"""
+        text, attr, cs = [], [], []
+        for row in rows:
+            for a, c, t in row:
+                if t:
+                    text.append(t)
+                    attr.append((a, len(t)))
+                    cs.append((c, len(t)))
+        return b''.join(text), attr, cs
+
+    def _layout(self, size):
+        """
+        returns the first and other rows of the displayed decoration, its
+        width and the size of the node widget, which is None if the node
+        widget is not displayed.
+        """
+        maxcol, = size
+        if self._width < maxcol:
+            return self._first, self._other, self._width, \
+                (maxcol - self._width,)
+
+        # too narrow: drop columns in the same way Columns does
+        widths = [width for width, first, other in self._prefix]
+        shared = maxcol - sum(widths)
+        node_size = None
+        if self.original_widget.selectable():
+            # the node is in focus, make room on the left
+            node_size = (1,)
+            shared -= 1
+            for i, width in enumerate(widths):
+                if shared >= 0:
+                    break
+                shared += width
+                widths[i] = 0
+            if shared > 0:
+                node_size = (1 + shared,)
+        else:
+            # the first column is in focus, drop what doesn't fit
+            shared = maxcol
+            for i, width in enumerate(widths):
+                if i > 0 and shared < width:
+                    widths[i:] = [0] * (len(widths) - i)
+                    break
+                shared -= width
+            if shared < 0:
+                widths[0] = 0
+        columns = [(w, first, other) for w, (_, first, other)
+                   in zip(widths, self._prefix) if w > 0]
+        return self._join_runs(first for w, first, o in columns), \
+            self._join_runs(other for w, f, other in columns), \
+            sum(widths), node_size
+
+    def _node_focus(self, focus):
+        # the node is the only column that may take the focus
+        return focus and (not self._prefix or
+                          self.original_widget.selectable())
+
+    def selectable(self):
+        return self.original_widget.selectable()
+
+    def rows(self, size, focus=False):
+        node_size = self._layout(size)[3]
+        if node_size is None:
+            return 1
+        return self.original_widget.rows(node_size, self._node_focus(focus))
+
+    def render(self, size, focus=False):
+        first, other, width, node_size = self._layout(size)
+        if node_size is None:
+            return urwid.TextCanvas([first[0]], [first[1]], [first[2]],
+                                    maxcol=size[0])
+        canvas = self.original_widget.render(node_size,
+                                             self._node_focus(focus))
+        if not width:
+            return canvas
+        rows = canvas.rows()
+        prefix = urwid.TextCanvas(
+            [first[0]] + [other[0]] * (rows - 1),
+            [first[1]] + [other[1]] * (rows - 1),
+            [first[2]] + [other[2]] * (rows - 1),
+            maxcol=width, check_width=False)
+        return urwid.CanvasJoin([(prefix, None, False, width),
+                                 (canvas, None, True, node_size[0])])
+
+    def keypress(self, size, key):
+        node_size = self._layout(size)[3]
+        if node_size is None or not self.original_widget.selectable():
+            return key
+        return self.original_widget.keypress(node_size, key)
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        widget = self.original_widget
+        first, other, width, node_size = self._layout(size)
+        if node_size is None or col < width or \
+                not hasattr(widget, 'mouse_event'):
+            return False
+        return widget.mouse_event(node_size, event, button, col - width, row,
+                                  self._node_focus(focus))
+
+    def get_cursor_coords(self, size):
+        widget = self.original_widget
+        first, other, width, node_size = self._layout(size)
+        if node_size is None or not widget.selectable() or \
+                not hasattr(widget, 'get_cursor_coords'):
+            return None
+        coords = widget.get_cursor_coords(node_size)
+        if coords is not None:
+            x, y = coords
+            coords = x + width, y
+        return coords
+
+    def move_cursor_to_coords(self, size, col, row):
+        widget = self.original_widget
+        first, other, width, node_size = self._layout(size)
+        if node_size is None or not widget.selectable():
+            return False
+        if hasattr(widget, 'move_cursor_to_coords'):
+            if isinstance(col, int):
+                col = min(max(0, col - width), node_size[0] - 1)
+            return widget.move_cursor_to_coords(node_size, col, row)
+        return True
+
+    def get_pref_col(self, size):
+        widget = self.original_widget
+        first, other, width, node_size = self._layout(size)
+        if node_size is None:
+            return None
+        col = None
+        if hasattr(widget, 'get_pref_col'):
+            col = widget.get_pref_col(node_size)
+            if isinstance(col, int):
+                col += width
+        if col is None and widget.selectable():
+            col = width + node_size[0] // 2
+        return col
+
+
+class DecorationPool(object):
+    """
+    Hands out shared instances of the widgets that decorations are made of.
+    These never change once constructed, so a single instance can be used in
+    any number of lines instead of allocating new ones for every line.
+    """
+    def __init__(self):
+        self._widgets = {}
+        # ids of everything handed out; stable as we keep references
+        self._shared = set()
+
+    def get(self, key, construct):
+        """
+        returns the object stored under key, calling `construct` to create it
+        on first use. Keys need to determine the constructed object completely.
+        Constructed tuples, like `(width, widget)` pairs, are shared together
+        with their items.
+        """
+        widget = self._widgets.get(key)
+        if widget is None:
+            widget = construct()
+            self._widgets[key] = widget
+            self._shared.add(id(widget))
+            if isinstance(widget, tuple):
+                self._shared.update(id(item) for item in widget)
+        return widget
+
+    def is_shared(self, widget):
+        """determine if widget has been handed out by this pool"""
+        return id(widget) in self._shared
+
+    def fill(self, char, att=None):
+        """SolidFill of char, displayed with attribute att if given"""
+        def construct():
+            widget = SolidFill(char)
+            if att is not None:
+                widget = AttrMap(widget, att)
+            return widget
+        return self.get(('fill', char, att), construct)
+
+    def text(self, txt, att=None):
+        """Text showing txt, displayed with attribute att if given"""
+        def construct():
+            widget = Text(txt)
+            if att is not None:
+                widget = AttrMap(widget, att)
+            return widget
+        return self.get(('text', txt, att), construct)
+
+    def pile(self, top, below, top_height='pack'):
+        """
+        Pile of `top`, with given height, above `below`. It is shared only
+        if both parts are, otherwise a new Pile is constructed.
+        """
+        def construct():
+            return urwid.Pile([(top_height, top), below])
+        if self.is_shared(top) and self.is_shared(below):
+            return self.get(('pile', id(top), id(below), top_height),
+                            construct)
+        return construct()
+
+    def glyphs(self, widget, width):
+        """
+        describes a shared box widget of at least two rows as decoration
+        column of given width for :class:`TreeLineWidget`. The widget is
+        rendered only once for each width.
+        """
+        def construct():
+            first, other = widget.render((width, 2)).content()
+            return width, list(first), list(other)
+        return self.get(('glyphs', id(widget), width), construct)
+
+    def line(self, cols):
+        """
+        builds a line from a list as accepted by :class:`urwid.Columns`:
+        decoration columns as `(width, box widget)` followed by the widget
+        of the node. This is a :class:`TreeLineWidget` if all decoration
+        widgets are shared, otherwise a Columns widget.
+        """
+        prefix = []
+        for width, widget in cols[:-1]:
+            if not self.is_shared(widget):
+                return urwid.Columns(cols, box_columns=range(len(cols))[:-1])
+            if width > 0:
+                prefix.append(self.glyphs(widget, width))
+            else:
+                prefix.append((0, [], []))
+        return TreeLineWidget(prefix, cols[-1])
+
 # Mixins for TreeListWalkers
 
 
 class CachingMixin(object):
-    """Mixin that allows TreeListWalkers to cache constructed line-widgets"""
-    def __init__(self, load, nextpos=None, prevpos=None, **kwargs):
-        self._cache = {}
+    """
+    Mixin that allows TreeListWalkers to cache constructed line-widgets
+    as well as the positions next to and previous to visited positions.
+    """
+    def __init__(self, load, nextpos=None, prevpos=None, cache_policy=None,
+                 **kwargs):
+        """
+        :param load: callable that constructs the line-widget for a position
+        :param cache_policy: callable that returns a new (empty) cache,
+            see :class:`caches.Cache`. Defaults to unbounded caches.
+        """
+        new_cache = cache_policy or Cache
+        self._cache = new_cache()
         self.load = load
-        self._next_cache = {}
+        self._next_cache = new_cache()
         self._next_position = nextpos or TreeListWalker.next_position
-        self._prev_cache = {}
+        self._prev_cache = new_cache()
         self._prev_position = prevpos or TreeListWalker.prev_position
+        # positions cached since the last call to retain_lines, if any
+        self._cached_positions = None
 
     def __getitem__(self, pos):
-        candidate = None
-        if pos in self._cache:
-            candidate = self._cache[pos]
-        else:
+        candidate = self._cache.get(pos)
+        if candidate is None:
             candidate = self.load(pos)
             self._cache[pos] = candidate
+            if self._cached_positions is not None:
+                self._cached_positions.add(pos)
         return candidate
 
     def next_position(self, pos):
@@ -246,6 +715,8 @@ class CachingMixin(object):
         if candidate is None and self._next_position is not None:
             candidate = self._next_position(self, pos)
             self._next_cache[pos] = candidate
+            if self._cached_positions is not None:
+                self._cached_positions.add(pos)
         return candidate
 
     def prev_position(self, pos):
@@ -253,8 +724,233 @@ class CachingMixin(object):
         if candidate is None and self._prev_position is not None:
             candidate = self._prev_position(self, pos)
             self._prev_cache[pos] = candidate
+            if self._cached_positions is not None:
+                self._cached_positions.add(pos)
         return candidate
 
+    def invalidate_children(self, pos):
+        """
+        drop cached data that depends on the children of pos: the line for pos
+        itself (it may display a collapse icon), the position following pos and
+        the position previous to the one following pos's subtree.
+        """
+        self._cache.pop(pos)
+        self._next_cache.pop(pos)
+        after = self._position_after_subtree(pos)
+        if after is not None:
+            self._prev_cache.pop(after)
+
+    def invalidate_subtree(self, pos):
+        """
+        drop cached lines and links for pos and for all of its descendants
+        that are reachable via cached links, as well as the link back into
+        the subtree from the position following it.
+        """
+        after = self._position_after_subtree(pos)
+        current = pos
+        while current is not None and current != after:
+            following = self._next_cache.pop(current)
+            self._cache.pop(current)
+            self._prev_cache.pop(current)
+            current = following
+        if after is not None:
+            self._prev_cache.pop(after)
+
+    def _invalidate_neighbours(self, pos):
+        """
+        drop the cached line of pos's parent (it may display a collapse icon)
+        and the cached links into and out of pos's subtree
+        """
+        parent = self.parent_position(pos)
+        if parent is not None:
+            self._cache.pop(parent)
+        before = self._prev_position(self, pos)
+        if before is not None:
+            self._next_cache.pop(before)
+        after = self._position_after_subtree(pos)
+        if after is not None:
+            self._prev_cache.pop(after)
+
+    def invalidate_line(self, pos):
+        """drop the cached line for pos"""
+        self._cache.pop(pos)
+
+    def invalidate_insertion(self, pos):
+        """drop cached data around a newly inserted pos"""
+        self._invalidate_neighbours(pos)
+
+    def invalidate_removal(self, pos):
+        """drop cached data around a removed pos and for its subtree"""
+        self._invalidate_neighbours(pos)
+        self._forget_subtree(pos)
+
+    def invalidate_appended(self, positions):
+        """
+        drop cached data around appended positions: for every parent that
+        gained children, its line and the links into and out of its new
+        children
+        """
+        for pos in self._first_appended(positions):
+            self._invalidate_neighbours(pos)
+            last = self._walker.last_sibling_position(pos)
+            if last != pos:
+                after = self._position_after_subtree(last)
+                if after is not None:
+                    self._prev_cache.pop(after)
+
+    def _forget_subtree(self, pos, links=True):
+        """
+        drop the cached lines of pos and all of its descendants, and their
+        links if `links` is set. Unlike :meth:`invalidate_subtree`, this
+        walks the underlying tree and so also finds the lines of descendants
+        that are currently hidden.
+        """
+        walker = self._walker
+        stack = [pos]
+        while stack:
+            current = stack.pop()
+            self._cache.pop(current)
+            if links:
+                self._next_cache.pop(current)
+                self._prev_cache.pop(current)
+            child = walker.first_child_position(current)
+            while child is not None:
+                stack.append(child)
+                child = walker.next_sibling_position(child)
+
+    def retain_lines(self, positions):
+        """
+        drop the cached lines and links, as well as other data memoized per
+        position, of all positions that are not in the given collection of
+        positions. Only positions cached since the previous call are
+        checked, so this takes time proportional to the retained positions
+        and those visited in between.
+        """
+        cached = self._cached_positions
+        if cached is None:
+            cached = set(self._cache)
+            cached.update(self._next_cache)
+            cached.update(self._prev_cache)
+        retained = set()
+        for pos in cached:
+            if pos in positions:
+                retained.add(pos)
+            else:
+                self._cache.pop(pos)
+                self._next_cache.pop(pos)
+                self._prev_cache.pop(pos)
+        self._cached_positions = retained
+        self._release_memos(positions)
+
+    def _release_memos(self, positions):
+        """
+        called by :meth:`retain_lines` to drop data memoized for positions
+        other than the given ones
+        """
+        pass
+
+    def cache_stats(self):
+        """usage counters for the caches of lines, next and prev positions"""
+        return {'lines': self._cache.stats(),
+                'next': self._next_cache.stats(),
+                'prev': self._prev_cache.stats()}
+
+
+class RowIndexMixin(object):
+    """
+    Mixin for TreeListWalkers that maintains an index of the displayed rows.
+    It finds the row of a position, the position in a row and the overall
+    number of rows in logarithmic time, e.g. to jump to a line or to draw a
+    scrollbar. Collapsing or expanding a subtree updates the index in
+    logarithmic time as well, if this is mixed in before
+    :class:`CollapseMixin`::
+
+        class IndexedArrows(RowIndexMixin, CollapsibleArrowTreeListWalker):
+            pass
+
+    The index is built on first use by walking the whole tree, so the tree
+    needs to be finite and positions need to be hashable. It is rebuilt
+    after the underlying TreeWalker reported changes.
+    """
+    _row_index = None
+
+    def _rows(self):
+        """returns the row index, (re)building it if necessary"""
+        if self._row_index is None or \
+                self._row_index_version != self._tree_version:
+            self.reindex_rows()
+        return self._row_index
+
+    def reindex_rows(self):
+        """build the row index from scratch"""
+        walker = self._walker
+        positions = []
+        ids = {}
+        ends = []
+        # ancestors of the current position, as ids
+        stack = []
+        pos = walker.root
+        while pos is not None:
+            parent = walker.parent_position(pos)
+            while stack and positions[stack[-1]] != parent:
+                ends[stack.pop()] = len(positions)
+            stack.append(len(positions))
+            ids[pos] = len(positions)
+            positions.append(pos)
+            ends.append(None)
+
+            # next position in depth-first order, ignoring collapses
+            candidate = walker.first_child_position(pos)
+            while candidate is None and pos is not None:
+                candidate = walker.next_sibling_position(pos)
+                pos = walker.parent_position(pos)
+            pos = candidate
+        for node in stack:
+            ends[node] = len(positions)
+
+        self._row_positions = positions
+        self._row_ids = ids
+        self._row_ends = ends
+        self._row_index = RowIndex(len(positions))
+        self._row_index_version = self._tree_version
+        is_collapsed = getattr(self, 'is_collapsed', None)
+        if is_collapsed is not None:
+            for node, pos in enumerate(positions):
+                if ends[node] > node + 1 and is_collapsed(pos):
+                    self._row_index.cover(node + 1, ends[node])
+
+    def _collapse_changed(self, pos):
+        if self._row_index is None:
+            return
+        if pos is None or self._row_index_version != self._tree_version:
+            self._row_index = None
+            return
+        node = self._row_ids.get(pos)
+        if node is not None and self._row_ends[node] > node + 1:
+            if self.is_collapsed(pos):
+                self._row_index.cover(node + 1, self._row_ends[node])
+            else:
+                self._row_index.uncover(node + 1, self._row_ends[node])
+
+    def row_count(self):
+        """number of rows of the displayed tree"""
+        return self._rows().rows()
+
+    def row_of_position(self, pos):
+        """row that displays pos, or None if pos is hidden"""
+        rows = self._rows()
+        node = self._row_ids.get(pos)
+        if node is None:
+            return None
+        return rows.row(node)
+
+    def position_at_row(self, row):
+        """position displayed in given row, or None if row doesn't exist"""
+        node = self._rows().node(row)
+        if node is None:
+            return None
+        return self._row_positions[node]
+
 
 class SelectableIcon(urwid.WidgetWrap):
     """selectable Text widget that handles keypresses with given callable"""
@@ -282,7 +978,12 @@ class CollapseMixin(object):
     def __init__(self, is_collapsed=lambda pos: False,
                  **kwargs):
         self._initially_collapsed = is_collapsed
-        self._divergent_positions = []
+        self._divergent_positions = set()
+        # maps positions to whether their children are hidden
+        self._hides_children = {}
+        # maps positions to the number of rows below them when expanded
+        self._descendant_rows = {}
+        self._memo_version = self._tree_version
 
     def is_collapsed(self, pos):
         collapsed = self._initially_collapsed(pos)
@@ -290,6 +991,29 @@ class CollapseMixin(object):
             collapsed = not collapsed
         return collapsed
 
+    def is_hidden(self, pos):
+        """
+        determine if pos is hidden because one of its ancestors is collapsed.
+        Results are memoized for all ancestors until the collapse state
+        changes, so siblings and cousins of pos are answered without
+        walking up the tree again.
+        """
+        self._drop_outdated_memos()
+        hidden = False
+        unknown = []
+        parent = self._walker.parent_position(pos)
+        while parent is not None:
+            known = self._hides_children.get(parent)
+            if known is not None:
+                hidden = known
+                break
+            unknown.append(parent)
+            parent = self._walker.parent_position(parent)
+        for ancestor in reversed(unknown):
+            hidden = hidden or self.is_collapsed(ancestor)
+            self._hides_children[ancestor] = hidden
+        return hidden
+
     def last_child_position(self, pos):
         if self.is_collapsed(pos):
             return None
@@ -301,14 +1025,168 @@ class CollapseMixin(object):
         return self._walker.first_child_position(pos)
 
     def set_position_collapsed(self, pos, is_collapsed):
-        if self._initially_collapsed(pos) == is_collapsed:
-            if pos in self._divergent_positions:
-                self._divergent_positions.remove(pos)
-                signals.emit_signal(self, "modified")
-        else:
-            if pos not in self._divergent_positions:
-                self._divergent_positions.append(pos)
-                signals.emit_signal(self, "modified")
+        self.set_positions_collapsed([pos], is_collapsed)
+
+    def set_positions_collapsed(self, positions, is_collapsed):
+        """
+        collapse or expand all given positions at once. Caches are
+        invalidated and the `modified` signal is emitted only once, after
+        all changes have been made.
+
+        :param positions: positions to change
+        :type positions: iterable
+        :param is_collapsed: whether they should be collapsed
+        :type is_collapsed: bool
+        """
+        changed = []
+        for pos in positions:
+            if self._initially_collapsed(pos) == is_collapsed:
+                if pos not in self._divergent_positions:
+                    continue
+                self._divergent_positions.discard(pos)
+            else:
+                if pos in self._divergent_positions:
+                    continue
+                self._divergent_positions.add(pos)
+            self._update_descendant_rows(pos)
+            self._collapse_changed(pos)
+            changed.append(pos)
+        if not changed:
+            return
+        self._hides_children.clear()
+        for pos in changed:
+            self.invalidate_children(pos)
+        # don't leave the focus in a subtree that just disappeared
+        if is_collapsed and self._focus is not None and \
+                self.is_hidden(self._focus):
+            newfocus = self._focus
+            parent = self._walker.parent_position(newfocus)
+            while parent is not None:
+                if self.is_collapsed(parent):
+                    newfocus = parent
+                parent = self._walker.parent_position(parent)
+            self.set_focus(newfocus)
+        signals.emit_signal(self, "modified")
+
+    def set_collapsed_where(self, predicate, is_collapsed, max_depth=None):
+        """
+        collapse or expand all positions for which `predicate` returns True,
+        considering only positions up to depth `max_depth`, if given.
+        Like :meth:`set_positions_collapsed`, this emits a single `modified`
+        signal. For example, to expand the first three levels of the tree::
+
+            walker.set_collapsed_where(lambda pos: True, False, max_depth=2)
+        """
+        walker = self._walker
+        positions = []
+        stack = [(walker.root, 0)]
+        while stack:
+            pos, depth = stack.pop()
+            if pos is None:
+                continue
+            stack.append((walker.next_sibling_position(pos), depth))
+            if predicate(pos):
+                positions.append(pos)
+            if max_depth is None or depth < max_depth:
+                stack.append((walker.first_child_position(pos), depth + 1))
+        self.set_positions_collapsed(positions, is_collapsed)
+
+    def _collapse_changed(self, pos):
+        """
+        called whenever the collapse state of pos changed, or with None if
+        that of all positions may have changed
+        """
+        pass
+
+    # row counts
+    def _drop_outdated_memos(self):
+        """drop memoized data if the tree changed since it was computed"""
+        if self._memo_version != self._tree_version:
+            self._hides_children.clear()
+            self._descendant_rows.clear()
+            self._memo_version = self._tree_version
+
+    def _release_memos(self, positions):
+        """
+        drop the memoized hidden states. Row counts are kept: they cover
+        whole subtrees rather than displayed lines and are only computed on
+        demand, e.g. for :meth:`visible_rows`.
+        """
+        self._hides_children.clear()
+
+    def _memoized_descendant_rows(self):
+        """memoized row counts, dropped if the tree changed since"""
+        self._drop_outdated_memos()
+        return self._descendant_rows
+
+    def _count_descendant_rows(self, pos):
+        """count and memoize the rows below pos and all of its descendants"""
+        walker = self._walker
+        counts = self._descendant_rows
+        stack = [(pos, False)]
+        while stack:
+            current, children_counted = stack.pop()
+            if children_counted:
+                rows = 0
+                child = walker.first_child_position(current)
+                while child is not None:
+                    rows += 1
+                    if not self.is_collapsed(child):
+                        rows += counts[child]
+                    child = walker.next_sibling_position(child)
+                counts[current] = rows
+            elif current not in counts:
+                stack.append((current, True))
+                child = walker.first_child_position(current)
+                while child is not None:
+                    stack.append((child, False))
+                    child = walker.next_sibling_position(child)
+        return counts[pos]
+
+    def _update_descendant_rows(self, pos):
+        """
+        adjust the memoized row counts of the ancestors of pos after its
+        collapse state changed
+        """
+        rows = self._memoized_descendant_rows().get(pos)
+        if not rows:
+            return
+        if self.is_collapsed(pos):
+            rows = -rows
+        parent = self._walker.parent_position(pos)
+        while parent is not None and parent in self._descendant_rows:
+            self._descendant_rows[parent] += rows
+            if self.is_collapsed(parent):
+                break
+            parent = self._walker.parent_position(parent)
+
+    def descendant_rows(self, pos):
+        """
+        number of rows the descendants of pos occupy if pos is expanded.
+        Counts are memoized and adjusted when subtrees are collapsed or
+        expanded, so after computing them once, this is a lookup.
+        """
+        rows = self._memoized_descendant_rows().get(pos)
+        if rows is None:
+            rows = self._count_descendant_rows(pos)
+        return rows
+
+    def hidden_rows(self, pos):
+        """number of rows that expanding pos would reveal"""
+        if self.is_collapsed(pos):
+            return self.descendant_rows(pos)
+        return 0
+
+    def visible_rows(self):
+        """number of rows of the displayed tree"""
+        rows = 0
+        root = self._walker.root
+        while root is not None:
+            rows += 1
+            if not self.is_collapsed(root):
+                rows += self.descendant_rows(root)
+            root = self._walker.next_sibling_position(root)
+        return rows
 
     def toggle_collapsed(self, pos):
         self.set_position_collapsed(pos, not self.is_collapsed(pos))
@@ -324,7 +1202,10 @@ class CollapseMixin(object):
 
     def set_collapsed_all(self, is_collapsed):
         self._initially_collapsed = lambda x: is_collapsed
-        self._divergent_positions = []
+        self._divergent_positions = set()
+        self._hides_children.clear()
+        self._descendant_rows.clear()
+        self._collapse_changed(None)
         newfocus = self._walker.first_ancestor(self._focus)
         self.set_focus(newfocus)
         signals.emit_signal(self, "modified")
@@ -341,9 +1222,9 @@ class CollapseMixin(object):
             del(self._prev_cache[pos])
 
     def clear_caches(self):
-        self._cache = {}
-        self._next_cache = {}
-        self._prev_cache = {}
+        self._cache.clear()
+        self._next_cache.clear()
+        self._prev_cache.clear()
 
 
 class CollapseIconMixin(CollapseMixin):
@@ -377,11 +1258,20 @@ class CollapseIconMixin(CollapseMixin):
         self._icon_focussed_att = icon_focussed_att
 
     def _construct_collapse_icon(self, pos):
+        collapsed = self.is_collapsed(pos)
+        if self._selectable_icons:
+            return self._build_collapse_icon(pos, collapsed)
+        # without keypress handlers for pos, icons can be shared by all lines
+        return self._decorations.get(
+            ('collapse-icon', collapsed),
+            lambda: self._build_collapse_icon(pos, collapsed))
+
+    def _build_collapse_icon(self, pos, collapsed):
         width = 0
         widget = None
         char = self._icon_expanded_char
         charatt = self._icon_expanded_att
-        if self.is_collapsed(pos):
+        if collapsed:
             char = self._icon_collapsed_char
             charatt = self._icon_collapsed_att
         if char is not None:
@@ -390,7 +1280,8 @@ class CollapseIconMixin(CollapseMixin):
             if self._icon_frame_left_char is not None:
                 lchar = self._icon_frame_left_char
                 charlen = len(lchar)
-                leftframe = Text((self._icon_frame_att, lchar))
+                leftframe = self._decorations.text((self._icon_frame_att,
+                                                    lchar))
                 columns.append((charlen, leftframe))
                 width += charlen
 
@@ -407,7 +1298,7 @@ class CollapseIconMixin(CollapseMixin):
                 widget = AttrMap(
                     widget, None, focus_map=self._icon_focussed_att)
             else:
-                widget = Text(markup)
+                widget = self._decorations.text(markup)
             charlen = len(char)
             columns.append((charlen, widget))
             width += charlen
@@ -415,7 +1306,8 @@ class CollapseIconMixin(CollapseMixin):
             if self._icon_frame_right_char is not None:
                 rchar = self._icon_frame_right_char
                 charlen = len(rchar)
-                rightframe = Text((self._icon_frame_att, rchar))
+                rightframe = self._decorations.text((self._icon_frame_att,
+                                                     rchar))
                 columns.append((charlen, rightframe))
                 width += charlen
 
@@ -434,6 +1326,153 @@ class CollapsibleTreeListWalker(CollapseMixin, TreeListWalker):
         CollapseMixin.__init__(self, **kwargs)
 
 
+class FilterMixin(object):
+    """
+    Mixin for TreeListWalker that only displays the positions matching a
+    predicate, together with their ancestors. Like :class:`CollapseMixin`,
+    this overwrites the methods for children and siblings, so that they skip
+    positions without matches in their subtree.
+
+    Whether a subtree contains a match is memoized per position and only
+    determined when a position is asked for, i.e. while the tree is
+    displayed and scrolled. A subtree is searched only until the first match
+    is found, so the first screen of a huge tree is displayed without
+    looking at the rest of it.
+    """
+    def __init__(self, predicate=lambda pos: True, **kwargs):
+        """
+        :param predicate: callable that accepts positions and returns True
+            for those that should be displayed
+        """
+        self._predicate = predicate
+        # maps positions to whether their subtree contains a match
+        self._subtree_matches = {}
+        self._subtree_matches_version = self._tree_version
+        self._move_focus_to_shown()
+
+    def _memoized_subtree_matches(self):
+        """memoized results, dropped if the tree changed since"""
+        if self._subtree_matches_version != self._tree_version:
+            self._subtree_matches.clear()
+            self._subtree_matches_version = self._tree_version
+        return self._subtree_matches
+
+    def subtree_matches(self, pos):
+        """
+        determine if pos or one of its descendants matches the predicate.
+        """
+        memo = self._memoized_subtree_matches()
+        known = memo.get(pos)
+        if known is not None:
+            return known
+        walker = self._walker
+        # maps positions on the stack to the child to continue with
+        resume = {}
+        stack = [pos]
+        while stack:
+            current = stack[-1]
+            if current in memo:
+                stack.pop()
+                continue
+            if current in resume:
+                child = resume[current]
+            elif self._predicate(current):
+                memo[current] = True
+                stack.pop()
+                continue
+            else:
+                child = walker.first_child_position(current)
+            result = False
+            while child is not None:
+                known = memo.get(child)
+                if known is None or known:
+                    result = known
+                    break
+                child = walker.next_sibling_position(child)
+            if result is None:
+                resume[current] = child
+                stack.append(child)
+            else:
+                del stack[-1]
+                resume.pop(current, None)
+                memo[current] = result
+        return memo[pos]
+
+    def is_shown(self, pos):
+        """determine if pos is displayed, i.e. its subtree contains a match"""
+        return self.subtree_matches(pos)
+
+    def set_filter(self, predicate):
+        """
+        replace the predicate. If the focussed position is not displayed
+        anymore, the focus moves to its closest displayed ancestor.
+        """
+        root = self._first_root_position()
+        while root is not None:
+            self.invalidate_subtree(root)
+            root = self.next_sibling_position(root)
+        self._predicate = predicate
+        self._subtree_matches.clear()
+        self._move_focus_to_shown()
+        signals.emit_signal(self, "modified")
+
+    def _move_focus_to_shown(self):
+        """move the focus to its closest displayed ancestor, if necessary"""
+        focus = self._focus
+        while focus is not None and not self.is_shown(focus):
+            focus = self._walker.parent_position(focus)
+        if focus is None:
+            focus = self._first_root_position()
+        if focus != self._focus:
+            self.set_focus(focus)
+
+    def _on_walker_changed(self, pos, change):
+        # the change may have removed the last match below the focus
+        TreeListWalker._on_walker_changed(self, pos, change)
+        self._move_focus_to_shown()
+
+    def _first_shown_sibling(self, pos, direction):
+        while pos is not None and not self.subtree_matches(pos):
+            pos = direction(pos)
+        return pos
+
+    def _first_root_position(self):
+        return self._first_shown_sibling(self._walker.root,
+                                         self._walker.next_sibling_position)
+
+    def _last_root_position(self):
+        return self._first_shown_sibling(
+            TreeListWalker._last_root_position(self),
+            self._walker.prev_sibling_position)
+
+    def first_child_position(self, pos):
+        return self._first_shown_sibling(
+            self._walker.first_child_position(pos),
+            self._walker.next_sibling_position)
+
+    def last_child_position(self, pos):
+        return self._first_shown_sibling(
+            self._walker.last_child_position(pos),
+            self._walker.prev_sibling_position)
+
+    def next_sibling_position(self, pos):
+        return self._first_shown_sibling(
+            self._walker.next_sibling_position(pos),
+            self._walker.next_sibling_position)
+
+    def prev_sibling_position(self, pos):
+        return self._first_shown_sibling(
+            self._walker.prev_sibling_position(pos),
+            self._walker.prev_sibling_position)
+
+
+class FilteredTreeListWalker(FilterMixin, TreeListWalker):
+    """Undecorated TreeListWalker that only shows matches and their ancestors"""
+    def __init__(self, treelistwalker, **kwargs):
+        TreeListWalker.__init__(self, treelistwalker, **kwargs)
+        FilterMixin.__init__(self, **kwargs)
+
+
 class IndentedTreeListWalker(TreeListWalker):
     """Indent tree nodes according to their depth in the tree"""
     def __init__(self, treewalker, indent=2, **kwargs):
@@ -444,6 +1483,7 @@ class IndentedTreeListWalker(TreeListWalker):
         :type indent: int
         """
         self._indent = indent
+        self._decorations = DecorationPool()
         TreeListWalker.__init__(self, treewalker, **kwargs)
 
     def __getitem__(self, pos):
@@ -459,10 +1499,10 @@ class IndentedTreeListWalker(TreeListWalker):
         line = None
         if pos is not None:
             indent = self._walker.depth(pos) * self._indent
-            cols = [(indent, urwid.SolidFill(' ')),  # spacer
+            cols = [(indent, self._decorations.fill(' ')),  # spacer
                     self._walker[pos]]  # original widget ]
-            # construct a Columns, defining all spacer as Box widgets
-            line = urwid.Columns(cols, box_columns=range(len(cols))[:-1])
+            # render decoration of all spacers directly, if possible
+            line = self._decorations.line(cols)
         return line
 
 
@@ -493,7 +1533,7 @@ class CollapsibleIndentedTreeListWalker(CollapseIconMixin, CachingMixin, Indente
         decoration columns depending on the existence of parent and sibling
         positions. The result is a urwid.Culumns widget.
         """
-        void = SolidFill(' ')
+        void = self._decorations.fill(' ')
         line = None
         if pos is not None:
             cols = []
@@ -502,7 +1542,7 @@ class CollapsibleIndentedTreeListWalker(CollapseIconMixin, CachingMixin, Indente
             # add spacer filling all but the last indent
             if depth > 0:
                 cols.append(
-                    (depth * self._indent, urwid.SolidFill(' '))),  # spacer
+                    (depth * self._indent, void)),  # spacer
 
             # construct last indent
             iwidth, icon = self._construct_collapse_icon(pos)
@@ -518,19 +1558,19 @@ class CollapsibleIndentedTreeListWalker(CollapseIconMixin, CachingMixin, Indente
                 if icon is not None:
                     # space to the left
                     cols.append(
-                        (available_space - firstindent_width, SolidFill(' ')))
+                        (available_space - firstindent_width, void))
                     # icon
-                    icon_pile = urwid.Pile([('pack', icon), void])
+                    icon_pile = self._decorations.pile(icon, void)
                     cols.append((iwidth, icon_pile))
                     # spacer until original widget
                     available_space = self._icon_offset
-                cols.append((available_space, SolidFill(' ')))
+                cols.append((available_space, void))
             else:  # otherwise just add another spacer
-                cols.append((self._indent, SolidFill(' ')))
+                cols.append((self._indent, void))
 
             cols.append(self._walker[pos])  # original widget ]
-            # construct a Columns, defining all spacer as Box widgets
-            line = urwid.Columns(cols, box_columns=range(len(cols))[:-1])
+            # render decoration of all spacers directly, if possible
+            line = self._decorations.line(cols)
 
         return line
 
@@ -539,10 +1579,6 @@ class CollapsibleIndentedTreeListWalker(CollapseIconMixin, CachingMixin, Indente
         CollapseMixin.clear_caches(self)
         CollapseMixin.set_collapsed_all(self, is_collapsed)
 
-    def set_position_collapsed(self, pos, is_collapsed):
-        CollapseMixin.clear_caches(self)
-        CollapseMixin.set_position_collapsed(self, pos, is_collapsed)
-
 
 class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
     """
@@ -584,32 +1620,116 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
         self._arrow_tip_char = arrow_tip_char
         self._arrow_tip_att = arrow_tip_att
         self._arrow_att = arrow_att
+        # spacers shared by all children of a parent position
+        self._spacer_flags_cache = {}
+        self._spacer_cache = {}
+
+    def invalidate_subtree(self, pos):
+        """
+        drop cached lines below pos as well as all cached spacers, as they
+        depend on the siblings of the ancestors of the nodes they decorate.
+        """
+        self._spacer_flags_cache.clear()
+        self._spacer_cache.clear()
+        CachingMixin.invalidate_subtree(self, pos)
+
+    def _invalidate_last_sibling(self, pos):
+        """
+        if pos is a last child, its previous sibling just gained or lost a
+        next sibling, which changes its connector and the spacers below it
+        """
+        walker = self._walker
+        if walker.next_sibling_position(pos) is not None:
+            return
+        prev = walker.prev_sibling_position(pos)
+        if prev is None:
+            return
+        self._spacer_flags_cache.clear()
+        self._spacer_cache.clear()
+        self._forget_subtree(prev, links=False)
+
+    def invalidate_insertion(self, pos):
+        CachingMixin.invalidate_insertion(self, pos)
+        self._invalidate_last_sibling(pos)
+
+    def invalidate_removal(self, pos):
+        self._spacer_flags_cache.clear()
+        self._spacer_cache.clear()
+        CachingMixin.invalidate_removal(self, pos)
+        self._invalidate_last_sibling(pos)
+
+    def invalidate_appended(self, positions):
+        """
+        additionally drop the lines of former last children, whose
+        connectors and spacers change now that they have next siblings
+        """
+        CachingMixin.invalidate_appended(self, positions)
+        for pos in self._first_appended(positions):
+            prev = self._walker.prev_sibling_position(pos)
+            if prev is not None:
+                self._spacer_flags_cache.clear()
+                self._spacer_cache.clear()
+                self._forget_subtree(prev, links=False)
+
+    def _release_memos(self, positions):
+        """keep only the spacers of the parents of given positions"""
+        parents = set(self._walker.parent_position(pos) for pos in positions)
+        for cache in (self._spacer_flags_cache, self._spacer_cache):
+            for parent in [p for p in cache if p not in parents]:
+                del cache[parent]
+
+    def _spacer_flags(self, parent):
+        """
+        returns a tuple of booleans, one for every indentation level left of
+        the children of parent, that determine if a vertical bar is drawn in
+        that level. Results are cached per parent, so siblings share them.
+        """
+        flags = ()
+        unknown = []
+        while parent is not None:
+            known = self._spacer_flags_cache.get(parent)
+            if known is not None:
+                flags = known
+                break
+            unknown.append(parent)
+            parent = self._walker.parent_position(parent)
+        for ancestor in reversed(unknown):
+            if self._walker.parent_position(ancestor) is not None:
+                sib = self._walker.next_sibling_position(ancestor)
+                flags = flags + (sib is not None,)
+            self._spacer_flags_cache[ancestor] = flags
+        return flags
 
     def _construct_spacer(self, pos, acc):
         """
         build a spacer that occupies the horizontally indented space between
         pos's parent and the root node. It will return a list of tuples to be
-        fed into a Columns widget.
+        fed into a Columns widget, followed by the entries of `acc`.
+        The spacer is built only once for all children of the same parent.
         """
         parent = self._walker.parent_position(pos)
-        if parent is not None:
-            grandparent = self._walker.parent_position(parent)
-            if self._indent > 0 and grandparent is not None:
-                parent_sib = self._walker.next_sibling_position(parent)
-                draw_vbar = parent_sib is not None and self._arrow_vbar_char is not None
-                space_width = self._indent - 1 * (
-                    draw_vbar) - self._childbar_offset
-                if space_width > 0:
-                    void = AttrMap(urwid.SolidFill(' '), self._arrow_att)
-                    acc.insert(0, ((space_width, void)))
-                if draw_vbar:
-                    barw = urwid.SolidFill(self._arrow_vbar_char)
-                    bar = AttrMap(
-                        barw, self._arrow_vbar_att or self._arrow_att)
-                    acc.insert(0, ((1, bar)))
-            return self._construct_spacer(parent, acc)
-        else:
+        if parent is None:
             return acc
+        spacer = self._spacer_cache.get(parent)
+        if spacer is None:
+            spacer = []
+            if self._indent > 0:
+                void = self._decorations.fill(' ', self._arrow_att)
+                bar = None
+                if self._arrow_vbar_char is not None:
+                    bar = self._decorations.fill(
+                        self._arrow_vbar_char,
+                        self._arrow_vbar_att or self._arrow_att)
+                for draw_vbar in self._spacer_flags(parent):
+                    draw_vbar = draw_vbar and bar is not None
+                    if draw_vbar:
+                        spacer.append((1, bar))
+                    space_width = self._indent - 1 * (
+                        draw_vbar) - self._childbar_offset
+                    if space_width > 0:
+                        spacer.append((space_width, void))
+            self._spacer_cache[parent] = spacer
+        return spacer + acc
 
     def _construct_connector(self, pos):
         """
@@ -618,17 +1738,15 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
         arrow tip
         """
         # connector symbol, either L or |- shaped.
-        connectorw = None
+        char = None
         connector = None
         if self._walker.next_sibling_position(pos) is not None:  # |- shaped
-            if self._arrow_connector_tchar is not None:
-                connectorw = Text(self._arrow_connector_tchar)
+            char = self._arrow_connector_tchar
         else:  # L shaped
-            if self._arrow_connector_lchar is not None:
-                connectorw = Text(self._arrow_connector_lchar)
-        if connectorw is not None:
+            char = self._arrow_connector_lchar
+        if char is not None:
             att = self._arrow_connector_att or self._arrow_att
-            connector = AttrMap(connectorw, att)
+            connector = self._decorations.text(char, att)
         return connector
 
     def _construct_arrow_tip(self, pos):
@@ -636,8 +1754,8 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
         arrow_tip = None
         width = 0
         if self._arrow_tip_char:
-            txt = Text(self._arrow_tip_char)
-            arrow_tip = AttrMap(txt, self._arrow_tip_att or self._arrow_att)
+            arrow_tip = self._decorations.text(
+                self._arrow_tip_char, self._arrow_tip_att or self._arrow_att)
             width = len(self._arrow_tip_char)
         return width, arrow_tip
 
@@ -647,7 +1765,7 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
         left. This is separate as it adds arrowtip and sibling connector.
         """
         cols = []
-        void = AttrMap(urwid.SolidFill(' '), self._arrow_att)
+        void = self._decorations.fill(' ', self._arrow_att)
         available_width = self._indent
 
         if self._walker.depth(pos) > 0:
@@ -658,13 +1776,13 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
                     raise TreeDecorationError(NO_SPACE_MSG)
                 available_width -= width
                 if self._walker.next_sibling_position(pos) is not None:
-                    barw = urwid.SolidFill(self._arrow_vbar_char)
-                    below = AttrMap(barw, self._arrow_vbar_att or
-                                    self._arrow_att)
+                    below = self._decorations.fill(
+                        self._arrow_vbar_char,
+                        self._arrow_vbar_att or self._arrow_att)
                 else:
                     below = void
                 # pile up connector and bar
-                spacer = urwid.Pile([('pack', connector), below])
+                spacer = self._decorations.pile(connector, below)
                 cols.append((width, spacer))
 
             #arrow tip
@@ -673,14 +1791,15 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
                 if awidth > available_width:
                     raise TreeDecorationError(NO_SPACE_MSG)
                 available_width -= awidth
-                at_spacer = urwid.Pile([('pack', at), void])
+                at_spacer = self._decorations.pile(at, void)
                 cols.append((awidth, at_spacer))
 
             # bar between connector and arrow tip
             if available_width > 0:
-                barw = urwid.SolidFill(self._arrow_hbar_char)
-                bar = AttrMap(barw, self._arrow_hbar_att or self._arrow_att)
-                hb_spacer = urwid.Pile([(1, bar), void])
+                bar = self._decorations.fill(
+                    self._arrow_hbar_char,
+                    self._arrow_hbar_att or self._arrow_att)
+                hb_spacer = self._decorations.pile(bar, void, 1)
                 cols.insert(1, (available_width, hb_spacer))
         return cols
 
@@ -705,8 +1824,8 @@ class ArrowTreeListWalker(CachingMixin, IndentedTreeListWalker):
 
             # add the original widget for this line
             cols.append(original_widget)
-            # construct a Columns, defining all spacer as Box widgets
-            line = urwid.Columns(cols, box_columns=range(len(cols))[:-1])
+            # render decoration of all spacers directly, if possible
+            line = self._decorations.line(cols)
         return line
 
 
@@ -717,7 +1836,21 @@ class CollapsibleArrowTreeListWalker(CollapseIconMixin, ArrowTreeListWalker):
         ArrowTreeListWalker.__init__(self, treelistwalker, indent, **kwargs)
         CollapseIconMixin.__init__(self, **kwargs)
 
+    def _release_memos(self, positions):
+        CollapseIconMixin._release_memos(self, positions)
+        ArrowTreeListWalker._release_memos(self, positions)
+
     def _construct_arrow_tip(self, pos):
+        has_children = self._walker.first_child_position(pos) is not None
+        if has_children and self._selectable_icons:
+            return self._build_arrow_tip(pos, has_children)
+        # tips without keypress handlers for pos can be shared by all lines
+        collapsed = has_children and self.is_collapsed(pos)
+        return self._decorations.get(
+            ('arrow-tip', has_children, collapsed),
+            lambda: self._build_arrow_tip(pos, has_children))
+
+    def _build_arrow_tip(self, pos, has_children):
 
         cols = []
         overall_width = self._icon_offset
@@ -725,12 +1858,13 @@ class CollapsibleArrowTreeListWalker(CollapseIconMixin, ArrowTreeListWalker):
         if self._icon_offset > 0:
             # how often do we repeat the hbar_char until width icon_offset is reached
             hbar_char_count = len(self._arrow_hbar_char) / self._icon_offset
-            barw = Text(self._arrow_hbar_char * hbar_char_count)
-            bar = AttrMap(barw, self._arrow_hbar_att or self._arrow_att)
+            bar = self._decorations.text(
+                self._arrow_hbar_char * hbar_char_count,
+                self._arrow_hbar_att or self._arrow_att)
             cols.insert(1, (self._icon_offset, bar))
 
         # add icon only for non-leafs
-        if self._walker.first_child_position(pos) is not None:
+        if has_children:
             iwidth, icon = self._construct_collapse_icon(pos)
             if icon is not None:
                 cols.insert(0, (iwidth, icon))
@@ -748,7 +1882,3 @@ class CollapsibleArrowTreeListWalker(CollapseIconMixin, ArrowTreeListWalker):
     def set_collapsed_all(self, is_collapsed):
         CollapseMixin.clear_caches(self)
         CollapseMixin.set_collapsed_all(self, is_collapsed)
-
-    def set_position_collapsed(self, pos, is_collapsed):
-        CollapseMixin.clear_caches(self)
-        CollapseMixin.set_position_collapsed(self, pos, is_collapsed)